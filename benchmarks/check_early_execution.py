@@ -0,0 +1,45 @@
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # the app modules
+from summarize_csv import summarize_csv, file_reader
+from code_exec import SafeCodeExecutorWithInputs
+from generate_data import generate_csv
+from fixtures import ANSWERS
+from run_benchmarks import execute_streamed
+
+# Check that the recorded answers run without errors when they are executed the way the app does while streaming:
+# the first code block early, the others afterwards. Blocks that use files written by the early block (the
+# dependent answer in fixtures.py) must get them staged. Exits with status 1 if a block fails.
+#
+#   python benchmarks/check_early_execution.py
+
+
+def main():
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix='csv_check_') as work_dir:
+        data_dir = os.path.join(work_dir, 'data')
+        os.makedirs(data_dir)
+        csv_path = generate_csv(os.path.join(work_dir, 'orders.csv'), rows=2000)
+        _, _, _, working_file = summarize_csv(csv_path, data_dir, use_cache=False)
+        for use_pool in [True, False]:
+            make_executor = lambda: SafeCodeExecutorWithInputs(timeout=100, max_memory_mb=2000, input_directory=data_dir,
+                                                               working_file=working_file, use_pool=use_pool,
+                                                               temp_root=os.path.join(work_dir, 'exec'))
+            for n, answer in enumerate(ANSWERS):
+                answer = answer.format(filepath=working_file, reader=file_reader(working_file))
+                results = execute_streamed(make_executor, answer)
+                for r in results:
+                    if not r.get('success'):
+                        failures += 1
+                        print(f"FAILED: answer {n}, block {r['block_index'] + 1} (pool: {use_pool}): {r.get('stderr')}")
+                for temp_dir in set(r['temp_dir'] for r in results if r.get('temp_dir')):
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+    print(f"{failures} blocks failed" if failures else "All answers ran without errors")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Recorded LLM answers for the benchmark datasets (see generate_data.py), replayed by the stub LLM.
+# {filepath} and {reader} are replaced by the working file and its reader, as the app tells the LLM in its prompt.
+
+ANSWERS = [
+    # simple filter
+    '''To keep only the orders with value_1, filter on category_0 and write the result to a new file.
+
+<code language="python">
+import pandas as pd
+
+df = {reader}('{filepath}')
+filtered = df[df['category_0'] == 'value_1']
+filtered.to_csv('orders_value_1.csv', index=False)
+print(f"{{len(filtered)}} orders")
+</code>''',
+
+    # aggregation
+    '''Group by category_0 and sum amount_1.
+
+<code language="python">
+import pandas as pd
+
+df = {reader}('{filepath}')
+totals = df.groupby('category_0', observed=True)['amount_1'].sum().reset_index().sort_values('amount_1', ascending=False)
+totals.to_csv("totals_per_category.csv", index=False)
+print(totals.head())
+</code>''',
+
+    # date filter
+    '''First convert the dates, then keep the weekend orders.
+
+<code language="python">
+import pandas as pd
+
+df = {reader}('{filepath}')
+dates = pd.to_datetime(df['date_2'])
+weekend = df[dates.dt.dayofweek >= 5]
+name = 'weekend_orders'
+weekend.to_csv(f"{{name}}.csv", index=False)
+</code>''',
+
+    # two independent blocks: a filter and a plot
+    '''The large orders, and a histogram of the amounts.
+
+<code language="python">
+import pandas as pd
+
+df = {reader}('{filepath}')
+df[df['amount_1'] > 200].to_csv('large_orders.csv', index=False)
+</code>
+
+<code language="python">
+import pandas as pd
+import matplotlib.pyplot as plt
+
+df = {reader}('{filepath}')
+df['amount_1'].plot.hist(bins=50)
+plt.savefig('amount_histogram.png')
+</code>''',
+
+    # two dependent blocks
+    '''First select the orders with missing amounts, then count them per category.
+
+<code language="python">
+import pandas as pd
+
+df = {reader}('{filepath}')
+df[df['amount_1'].isna()].to_csv('missing_amounts.csv', index=False)
+</code>
+
+<code language="python">
+import pandas as pd
+
+missing = pd.read_csv('missing_amounts.csv')
+counts = missing['category_0'].value_counts().reset_index()
+counts.to_csv('missing_per_category.csv', index=False)
+print(counts)
+</code>''',
+]
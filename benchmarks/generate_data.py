@@ -0,0 +1,46 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+# Synthetic csv datasets for the benchmarks, shaped like the order data the app is used with:
+# an identifier column, text columns with a given number of distinct values, numbers, dates and missing values.
+
+
+def generate_frame(rows, columns=10, cardinality=50, null_rate=0.05, seed=0):
+    """
+    Data frame with an order_id column and columns-1 further columns, cycling through text (category_i), numbers
+    (amount_i) and dates (date_i). cardinality: distinct values per text column; null_rate: fraction of missing values.
+    """
+    rng = np.random.default_rng(seed)
+    data = {'order_id': np.arange(1, rows + 1).astype(str)}
+    for i in range(columns - 1):
+        kind = i % 3
+        if kind == 0:
+            values = np.array([f'value_{j}' for j in range(cardinality)], dtype=object)
+            column = pd.Series(values[rng.integers(0, cardinality, rows)], name=f'category_{i}')
+        elif kind == 1:
+            column = pd.Series(rng.gamma(2.0, 50.0, rows).round(2), name=f'amount_{i}')
+        else:
+            column = pd.Series(pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 24, rows), unit='h'),
+                               name=f'date_{i}')
+        if null_rate:
+            column = column.mask(rng.random(rows) < null_rate)
+        data[column.name] = column
+    return pd.DataFrame(data)
+
+
+def generate_csv(path, rows, columns=10, cardinality=50, null_rate=0.05, seed=0):
+    generate_frame(rows, columns, cardinality, null_rate, seed).to_csv(path, index=False)
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic csv dataset")
+    parser.add_argument('path')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--cardinality', type=int, default=50)
+    parser.add_argument('--null-rate', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_csv(args.path, args.rows, args.columns, args.cardinality, args.null_rate, args.seed)
@@ -0,0 +1,162 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # the app modules
+from summarize_csv import summarize_csv, file_reader, load_working_file
+from code_exec import SafeCodeExecutorWithInputs, publish_outputs
+from resource_limits import start_accounting, finish_accounting
+from prompt_builder import PromptBuilder
+from prompts import template, values_section
+from value_index import ValueIndex, index_file_name, describe_matches
+from generate_data import generate_csv
+from stub_llm import StubLLM
+from fixtures import ANSWERS
+
+# Benchmark of the summarize -> prompt -> generate -> execute -> load pipeline of the app, on synthetic datasets,
+# with a stub LLM that replays recorded answers. Reports p50/p95 latency, throughput and peak memory per stage,
+# and writes them as json, so results of different versions can be compared.
+#
+#   python benchmarks/run_benchmarks.py --rows 10000 100000 --repeat 5 --output results.json
+
+
+class StageTimer:
+    """Collects the samples (seconds, peak RSS) of the stages"""
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage, seconds, peak_rss_mb=None):
+        self.samples.setdefault(stage, []).append((seconds, peak_rss_mb))
+
+    def measure(self, stage, function, *args, **kwargs):
+        """Run function in this process, and record its wall time and peak RSS"""
+        snapshot = start_accounting()
+        value = function(*args, **kwargs)
+        resources = finish_accounting(snapshot)
+        self.add(stage, resources['wall_seconds'], resources['peak_rss_mb'])
+        return value
+
+    def report(self):
+        report = {}
+        for stage, samples in self.samples.items():
+            seconds = np.array([s for s, _ in samples])
+            peaks = [p for _, p in samples if p is not None]
+            report[stage] = {
+                'n': len(samples),
+                'p50_seconds': round(float(np.percentile(seconds, 50)), 4),
+                'p95_seconds': round(float(np.percentile(seconds, 95)), 4),
+                'per_second': round(len(samples) / seconds.sum(), 2) if seconds.sum() else None,
+                'peak_rss_mb': max(peaks) if peaks else None,
+            }
+        return report
+
+
+def execute_streamed(make_executor, answer):
+    """
+    Execute an answer the way the app does while it streams (csv_app.stream_answer and execute_code): the first
+    complete code block(s) start on the partial answer, the remaining blocks run afterwards with the early results.
+    Returns the results of all blocks, in block order.
+    """
+    end = answer.find('</code>')
+    partial = answer[:end + len('</code>')] if end >= 0 else answer
+    executor = make_executor()
+    early = executor.execute_safe(partial)
+    skip_blocks = len(executor.extract_code_blocks(partial))
+    return early + make_executor().execute_safe(answer, skip_blocks=skip_blocks, previous_results=early)
+
+
+def benchmark_dataset(csv_path, work_dir, repeat, use_pool, llm):
+    timer = StageTimer()
+    data_dir = os.path.join(work_dir, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    for _ in range(repeat):
+        info, column_info, extra_info, working_file = timer.measure(
+            'summarize', summarize_csv, csv_path, data_dir, use_cache=False)
+    reader = file_reader(working_file)
+    value_index = ValueIndex.load(os.path.join(data_dir, index_file_name(working_file)))
+    builder = PromptBuilder() # with the same budget as the app
+
+    def build_prompt(question):
+        values = values_section(describe_matches(value_index.lookup(question)))
+        return builder.build(template, question, info, column_info, extra_info, [], filepath=working_file,
+                             reader=reader, state='', values=values)
+
+    for i in range(repeat * len(ANSWERS)):
+        question = f'Show the orders where category_0 is value_{i % 7} and amount_1 is above 100' # values are looked up
+        prompt = timer.measure('prompt', build_prompt, question)
+        answer = timer.measure('generate', lambda: ''.join(chunk.content for chunk in llm.stream(prompt)))
+        answer = answer.format(filepath=working_file, reader=reader)
+
+        make_executor = lambda: SafeCodeExecutorWithInputs(timeout=100, max_memory_mb=2000, input_directory=data_dir,
+                                                           working_file=working_file, use_pool=use_pool,
+                                                           temp_root=os.path.join(work_dir, 'exec'))
+        start = time.perf_counter()
+        results = execute_streamed(make_executor, answer)
+        peaks = [r['resources']['peak_rss_mb'] for r in results if r.get('resources', {}).get('peak_rss_mb')]
+        timer.add('execute', time.perf_counter() - start, max(peaks) if peaks else None)
+        for r in results:
+            if not r.get('success'):
+                print(f"Block failed: {r.get('stderr')}", file=sys.stderr)
+            if r.get('staging'):
+                timer.add('stage_inputs', r['staging']['seconds'])
+            if r.get('resources'):
+                timer.add('run_block', r['resources']['wall_seconds'], r['resources'].get('peak_rss_mb'))
+
+        outputs = []
+        for r in results:
+            outputs.extend(publish_outputs(r, data_dir))
+            if r.get('temp_dir'):
+                shutil.rmtree(r['temp_dir'], ignore_errors=True)
+        for fn in outputs:
+            if fn.endswith('.csv') or fn.endswith('.parquet'):
+                timer.measure('load_result', load_working_file, os.path.join(data_dir, fn))
+    return timer.report()
+
+
+def print_report(name, report):
+    print(f"\n{name}")
+    print(f"{'stage':<14}{'n':>6}{'p50 s':>10}{'p95 s':>10}{'per s':>10}{'peak MB':>10}")
+    for stage, stats in report.items():
+        print(f"{stage:<14}{stats['n']:>6}{stats['p50_seconds']:>10}{stats['p95_seconds']:>10}"
+              f"{stats['per_second'] or '':>10}{stats['peak_rss_mb'] or '':>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the summarize -> generate -> execute pipeline")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--columns', type=int, nargs='+', default=[10])
+    parser.add_argument('--cardinality', type=int, default=50)
+    parser.add_argument('--null-rate', type=float, default=0.05)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--subprocess', action='store_true', help="run code in a new process per block instead of the worker pool")
+    parser.add_argument('--llm-latency', type=float, default=0.0, help="seconds until the stub LLM streams its first chunk")
+    parser.add_argument('--output', help="write the report as json to this file")
+    args = parser.parse_args()
+
+    llm = StubLLM(ANSWERS, first_token_seconds=args.llm_latency)
+    reports = {'python': platform.python_version(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'datasets': {}}
+    with tempfile.TemporaryDirectory(prefix='csv_benchmark_') as work_dir:
+        for rows in args.rows:
+            for columns in args.columns:
+                name = f'{rows}x{columns}'
+                dataset_dir = os.path.join(work_dir, name)
+                os.makedirs(dataset_dir)
+                csv_path = generate_csv(os.path.join(dataset_dir, f'orders_{name}.csv'), rows, columns,
+                                        args.cardinality, args.null_rate)
+                report = benchmark_dataset(csv_path, dataset_dir, args.repeat, not args.subprocess, llm)
+                report['summarize']['rows_per_second'] = round(rows / report['summarize']['p50_seconds'])
+                reports['datasets'][name] = report
+                print_report(f"{name} ({os.path.getsize(csv_path) / 1024**2:.1f} MB)", report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(reports, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
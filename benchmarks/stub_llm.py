@@ -0,0 +1,24 @@
+import itertools
+import time
+from types import SimpleNamespace
+
+# Local stand-in for the ChatOpenAI client: replays recorded answers with a configurable latency,
+# so the pipeline can be benchmarked without API calls (and without their variance).
+
+
+class StubLLM:
+    def __init__(self, answers, first_token_seconds=0.0, seconds_per_chunk=0.0, chunk_size=20):
+        self.answers = itertools.cycle(answers)
+        self.first_token_seconds = first_token_seconds
+        self.seconds_per_chunk = seconds_per_chunk
+        self.chunk_size = chunk_size # characters per streamed chunk
+
+    def stream(self, prompt):
+        answer = next(self.answers)
+        time.sleep(self.first_token_seconds)
+        for start in range(0, len(answer), self.chunk_size):
+            time.sleep(self.seconds_per_chunk)
+            yield SimpleNamespace(content=answer[start:start + self.chunk_size])
+
+    def invoke(self, prompt):
+        return SimpleNamespace(content=''.join(chunk.content for chunk in self.stream(prompt)))
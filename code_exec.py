@@ -2,14 +2,158 @@ import subprocess
 import tempfile
 import os
 import shutil
-import glob
+import time
+import copy
+import json
+import threading
+import atexit
+import contextvars
+import stat
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from worker_pool import get_worker_pool, Worker, wait_for_result
+from shared_data import prepare_shared_dataset
+from resource_limits import MAX_OPEN_FILES, MAX_OUTPUT_MB
+from write_manifest import manifest_outputs
+from disk_cache import file_fingerprint
+from tracing import span
+
+# methods whose first argument is a file that gets written
+WRITE_METHODS = {'to_csv', 'to_parquet', 'to_feather', 'to_excel', 'to_json', 'to_pickle', 'savefig'}
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH # mode of staged input files
+WRITABLE = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+KERNEL_IDLE_SECONDS = 1800 # session kernels that are not used for this long are shut down
+MAX_KERNELS = 8
+
+
+class SessionKernel:
+    """
+    Persistent Python process for one session, like a Jupyter kernel: variables (including df) are kept between
+    executions, so follow-up questions can work on intermediate results that are already in memory.
+    The code runs with the same limits and recorded writes as on the worker pool. The variables are lost when
+    the code times out or is cancelled (the process is killed), or when the dataset changes.
+    """
+    def __init__(self, startup_timeout=60):
+        self.context = get_worker_pool().context # shares the forkserver with the preloaded modules
+        self.home = os.getcwd()
+        self.startup_timeout = startup_timeout
+        self.lock = threading.Lock()
+        self.worker = None
+        self.arrow_path = None # dataset that df in the kernel was loaded from
+        self.last_used = time.time()
+    
+    def _ready_worker(self):
+        if self.worker is None or not self.worker.process.is_alive():
+            self.reset()
+            self.worker = Worker(self.context)
+        if not self.worker.wait_ready(self.startup_timeout):
+            self.reset()
+            raise RuntimeError('Kernel did not start')
+        return self.worker
+    
+    def reset(self):
+        """Stop the kernel process, all variables are lost"""
+        if self.worker is not None:
+            self.worker.kill()
+        self.worker = None
+        self.arrow_path = None
+    
+    def run(self, code, cwd, timeout, shared=None, cancel_event=None, limits=None):
+        """Same interface as WorkerPool.run, but the variables of earlier runs are available"""
+        with self.lock:
+            self.last_used = time.time()
+            if shared and self.arrow_path and shared['arrow_path'] != self.arrow_path: # other data, so the variables are stale
+                self.reset()
+            worker = self._ready_worker()
+            self.arrow_path = shared['arrow_path'] if shared else self.arrow_path
+            try:
+                worker.conn.send({'code': code, 'cwd': cwd, 'home': self.home, 'shared': shared, 'limits': limits,
+                                  'persistent': True})
+                finished, cancelled = wait_for_result(worker, timeout, cancel_event)
+                result = worker.conn.recv() if finished else None
+            except (EOFError, OSError):
+                self.reset()
+                return {'success': False, 'stdout': '', 'stderr': 'Kernel died during execution, its variables were lost'}
+            if not finished:
+                self.reset()
+                if cancelled:
+                    return {'success': False, 'stdout': '', 'stderr': 'Code execution was cancelled'}
+                raise TimeoutError(f'Code execution timed out after {timeout} seconds')
+            return result
+    
+    def variables(self, timeout=10):
+        """Description of the variables in the kernel, one per line (empty if there are none)"""
+        with self.lock:
+            if self.worker is None or not self.worker.process.is_alive():
+                return ''
+            try:
+                self.worker.conn.send({'describe': True})
+                if self.worker.conn.poll(timeout):
+                    return self.worker.conn.recv()
+            except (EOFError, OSError):
+                pass
+            self.reset()
+            return ''
+
+
+_kernels = {}
+_kernels_lock = threading.Lock()
+
+
+def _shut_down_if_idle(kernel):
+    """Stop a kernel unless it is running code right now (then it is kept). Returns whether it was stopped."""
+    if not kernel.lock.acquire(blocking=False):
+        return False
+    try:
+        kernel.reset()
+    finally:
+        kernel.lock.release()
+    return True
+
+
+def get_session_kernel(session_id):
+    """
+    The kernel of a session. Idle kernels of other sessions are shut down, and at most MAX_KERNELS are kept
+    (more only while all of them are running code: a kernel is never stopped in the middle of a job).
+    """
+    with _kernels_lock:
+        now = time.time()
+        for other, kernel in list(_kernels.items()):
+            if other != session_id and now - kernel.last_used > KERNEL_IDLE_SECONDS and _shut_down_if_idle(kernel):
+                del _kernels[other]
+        if session_id not in _kernels:
+            for oldest in sorted(_kernels, key=lambda other: _kernels[other].last_used): # least recently used first
+                if len(_kernels) < MAX_KERNELS:
+                    break
+                if _shut_down_if_idle(_kernels[oldest]):
+                    del _kernels[oldest]
+            _kernels[session_id] = SessionKernel()
+        return _kernels[session_id]
+
+
+@atexit.register
+def _shutdown_kernels():
+    for kernel in _kernels.values():
+        kernel.reset()
+
 
 class SafeCodeExecutorWithInputs:
-    def __init__(self, timeout=5, max_memory_mb=50, input_directory=None):
+    def __init__(self, timeout=5, max_memory_mb=50, input_directory=None, use_pool=True, working_file=None,
+                 max_cpu_seconds=None, max_open_files=MAX_OPEN_FILES, max_output_mb=MAX_OUTPUT_MB, temp_root=None,
+                 memo=None, kernel=None):
         self.timeout = timeout
-        self.max_memory_mb = max_memory_mb
+        self.max_memory_mb = max_memory_mb # memory the code may allocate, on top of what the interpreter already uses
+        self.max_cpu_seconds = max_cpu_seconds or timeout
+        self.max_open_files = max_open_files
+        self.max_output_mb = max_output_mb
         self.temp_dir = None
+        self.temp_root = temp_root # where the execution directories are made; on the file system of the input directory, outputs can be moved instead of copied
+        self.staging = {} # cost of setting up the input files for the last execution
+        self.cancel_event = None
+        self.use_pool = use_pool # run code on the warm worker pool instead of a new python3 process per block
+        self.working_file = working_file # dataset of the session, preloaded in the workers (name of a file in the input directory)
+        self.memo = memo # optional execution_cache.ExecutionCache, results of code that ran before on the same inputs are reused
+        self.kernel = kernel # optional SessionKernel, then the code runs there with the variables of earlier code (not memoized)
         
         # Set default input directory to current working directory
         self.input_directory = input_directory or os.getcwd()
@@ -53,124 +197,299 @@ class SafeCodeExecutorWithInputs:
                 return False, f"Dangerous operation detected: {pattern}"
         return True, None 
     
-    def setup_all_files_from_directory(self, directory_path=None):
-        """Copy all files from a directory to the execution environment"""
+    def file_references(self, code):
+        """
+        Find the file names used in the code (string constants), and which of them are written to
+        (first argument of to_csv, savefig, etc.). Returns (referenced, written) as sets of base names.
+        """
+        import ast
+        referenced, written = set(), set()
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return referenced, written
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Constant) and isinstance(node.value, str) and len(node.value) < 260:
+                referenced.add(os.path.basename(node.value))
+            elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in WRITE_METHODS:
+                target = node.args[0] if node.args else None
+                if isinstance(target, ast.Constant) and isinstance(target.value, str):
+                    written.add(os.path.basename(target.value))
+        return referenced, written
+    
+    def block_dependencies(self, code_blocks):
+        """
+        For every code block, the set of earlier blocks it depends on: blocks that write a file it refers to
+        (or that write files with names that can't be determined from the code, to be safe).
+        """
+        if self.kernel is not None: # blocks can use each other's variables, so they run one after the other
+            return [set(range(j)) for j in range(len(code_blocks))]
+        references = [self.file_references(code) for code in code_blocks]
+        dependencies = []
+        for j, (referenced, _) in enumerate(references):
+            dependencies.append({i for i in range(j) if references[i][1] & referenced
+                                 or self.writes_unknown_files(code_blocks[i])})
+        return dependencies
+    
+    def writes_unknown_files(self, code):
+        """True if the code writes to a file whose name is not a string constant"""
+        import ast
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            return False
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in WRITE_METHODS:
+                target = node.args[0] if node.args else None
+                if not (isinstance(target, ast.Constant) and isinstance(target.value, str)):
+                    return True
+        return False
+    
+    def setup_all_files_from_directory(self, directory_path=None, code=None, extra_inputs=None):
+        """
+        Make the files from a directory available in the execution environment, without copying the data:
+        the files are made read-only and hard linked (or symlinked if that is not possible). Files that the code writes
+        to are copied; writes to other staged files replace the link by a copy of its own (see write_manifest.detach),
+        so the originals are not modified. If code is given, only the files it refers to are made available.
+        extra_inputs: optional dict file name -> path of further files (e.g. outputs of earlier code blocks)
+        """
+        start = time.perf_counter()
+        self.staging = {}
         source_dir = directory_path or self.input_directory
         
         if not os.path.exists(source_dir):
             print(f"⚠️  Input directory not found: {source_dir}")
             return []
-            
-        copied_files = []
         
-        # Copy all files (not directories) from source directory
-        for item in os.listdir(source_dir):
-            source_path = os.path.join(source_dir, item)
-            
-            if os.path.isfile(source_path):
-                dest_path = os.path.join(self.temp_dir, item)
+        files = [item for item in os.listdir(source_dir) if os.path.isfile(os.path.join(source_dir, item))]
+        written = set()
+        if code is not None:
+            referenced, written = self.file_references(code)
+            used = [item for item in files if item in referenced]
+            if used: # otherwise the names are probably constructed in the code, so everything is made available
+                files = used
+        
+        sources = {item: os.path.join(source_dir, item) for item in files}
+        sources.update(extra_inputs or {})
+        staged_files = []
+        linked = copied = 0
+        for item, source_path in sources.items():
+            source_path = os.path.abspath(source_path)
+            dest_path = os.path.join(self.temp_dir, item)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True) # outputs of earlier blocks can be in subdirectories
+            if item in written:
                 shutil.copy2(source_path, dest_path)
-                copied_files.append(item)
-                
-        print(f"📁 Copied {len(copied_files)} files from {source_dir}")
-        return copied_files
-    
-    def execute_with_inputs(self, code, input_files=None, copy_all_inputs=False):
-        """Execute code with access to specified input files"""
-        # Create execution directory
-        self.temp_dir = tempfile.mkdtemp(prefix="code_exec_")
+                os.chmod(dest_path, os.stat(dest_path).st_mode | stat.S_IWUSR)
+                copied += 1
+            else:
+                if os.stat(source_path).st_mode & WRITABLE: # the app itself replaces data files instead of writing them
+                    os.chmod(source_path, READ_ONLY)
+                try:
+                    os.link(source_path, dest_path)
+                except OSError: # e.g. different file systems
+                    os.symlink(source_path, dest_path)
+                linked += 1
+            staged_files.append(item)
         
+        self.staging = {'files': len(staged_files), 'linked': linked, 'copied': copied,
+                        'seconds': round(time.perf_counter() - start, 4)}
+        print(f"📁 Staged {len(staged_files)} files from {source_dir} ({linked} linked, {copied} copied) in {self.staging['seconds']}s")
+        return staged_files
+    
+    def limits(self):
+        """Resource limits for the code, see resource_limits.apply_limits"""
+        return {'max_memory_mb': self.max_memory_mb, 'max_cpu_seconds': self.max_cpu_seconds,
+                'max_open_files': self.max_open_files, 'max_output_mb': self.max_output_mb}
+    
+    def memo_key(self, code, available_files):
+        """Key of the memoized result of code with the staged input files, or None"""
+        variant = 'subprocess'
+        if self.use_pool and self.working_file: # the code also sees the working dataset as df
+            variant = file_fingerprint(os.path.join(self.input_directory, self.working_file))
         try:
-            # Set up input files
-            if copy_all_inputs:
-                available_files = self.setup_all_files_from_directory()
-            #else:
-                #available_files = self.setup_input_files(input_files)
-            
-            # Show available files to the code
-            if available_files:
-                print(f"📂 Available input files: {', '.join(available_files)}")
-            
-            # Modify code to run in temp directory
-            modified_code = f'''
+            return self.memo.key(code, {fn: os.path.join(self.temp_dir, fn) for fn in available_files}, variant)
+        except OSError:
+            return None
+    
+    def shared_dataset(self):
+        """Arrow copy of the working file for the worker pool, so generated code doesn't have to parse the csv"""
+        if not self.working_file:
+            return None
+        try:
+            arrow_path = prepare_shared_dataset(os.path.join(self.input_directory, self.working_file))
+        except Exception as e:
+            print(f"⚠️  Could not prepare shared dataset: {e}")
+            return None
+        return {'file_name': self.working_file, 'arrow_path': os.path.abspath(arrow_path)}
+    
+    def run_in_subprocess(self, code):
+        """Execute code in a new python3 process (slower alternative to the worker pool)"""
+        # Modify code to run in temp directory
+        modified_code = f'''
 import os
 os.chdir(r"{self.temp_dir}")
 
 # List available files for debugging
-#import glob
-#available_files = glob.glob("*")
+##available_files = glob.glob("*")
 #if available_files:
     #print("Available files in execution directory:", available_files)
 
 # Original code
 {code}
 '''
-            
-            # Create and execute script
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                f.write(modified_code)
-                temp_script = f.name
-            
-            try:
-                cmd = [
-                    'python3',
-                    '-c',
-                    f'''
+        
+        # Create and execute script
+        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
+            f.write(modified_code)
+            temp_script = f.name
+        
+        report_file = temp_script + '.report' # resources used and files written, reported by the process
+        try:
+            cmd = [
+                'python3',
+                '-c',
+                f'''
 import sys
-import resource
+sys.path.insert(0, r"{os.path.dirname(os.path.abspath(__file__))}")
+import json
+from resource_limits import apply_limits, install_signal_handlers, start_accounting, finish_accounting
+from write_manifest import record_writes, restore_writes
 
-# Set memory limit
-#resource.setrlimit(resource.RLIMIT_AS, ({self.max_memory_mb * 1024 * 1024}, {self.max_memory_mb * 1024 * 1024}))
+# Record the files that are written, set resource limits, and measure what the code uses
+snapshot = start_accounting()
+install_signal_handlers()
+written = set()
+original_writers = record_writes(written)
+apply_limits({self.limits()!r})
 
 # Execute the script
-with open("{temp_script}", "r") as f:
-    code = f.read()
-    exec(code)
+try:
+    with open("{temp_script}", "r") as f:
+        code = f.read()
+        exec(code)
+finally:
+    restore_writes(original_writers)
+    with open("{report_file}", "w") as f:
+        json.dump({{'resources': finish_accounting(snapshot), 'written': sorted(written)}}, f)
 '''
-                ]
-                
-                result = subprocess.run(
-                    cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=self.timeout
-                )
+            ]
+            
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True
+            )
+            deadline = time.monotonic() + self.timeout
+            while True:
+                try:
+                    stdout, stderr = process.communicate(timeout=0.2)
+                    break
+                except subprocess.TimeoutExpired:
+                    cancelled = self.cancel_event is not None and self.cancel_event.is_set()
+                    if cancelled or time.monotonic() > deadline:
+                        process.kill()
+                        process.communicate()
+                        if cancelled:
+                            return {'success': False, 'stdout': '', 'stderr': 'Code execution was cancelled'}
+                        raise subprocess.TimeoutExpired(cmd, self.timeout)
+            result = {'success': process.returncode == 0, 'stdout': stdout, 'stderr': stderr}
+            try:
+                with open(report_file) as f:
+                    result.update(json.load(f))
+            except (OSError, ValueError): # e.g. the process was killed
+                pass
+            return result
+        finally:
+            for path in (temp_script, report_file):
+                try:
+                    os.unlink(path)
+                except:
+                    pass
+    
+    def execute_with_inputs(self, code, input_files=None, copy_all_inputs=False, extra_inputs=None):
+        """Execute code with access to specified input files"""
+        # Create execution directory
+        if self.temp_root:
+            os.makedirs(self.temp_root, exist_ok=True)
+        self.temp_dir = tempfile.mkdtemp(prefix="code_exec_", dir=self.temp_root and os.path.abspath(self.temp_root))
+        
+        try:
+            # Set up input files
+            if copy_all_inputs:
+                with span('staging') as s:
+                    available_files = self.setup_all_files_from_directory(code=code, extra_inputs=extra_inputs)
+                    s.set(**self.staging)
+            #else:
+                #available_files = self.setup_input_files(input_files)
+            
+            # Show available files to the code
+            if available_files:
+                print(f"📂 Available input files: {', '.join(available_files)}")
+            
+            memo_key = None
+            if self.memo is not None and self.kernel is None: # with a kernel, the result also depends on its variables
+                memo_key = self.memo_key(code, available_files)
+            if memo_key:
+                with span('memo_lookup') as s:
+                    memoized = self.memo.lookup(memo_key, self.temp_dir)
+                    s.set(hit=memoized is not None)
+                if memoized:
+                    print("♻️  Using memoized result")
+                    return {
+                        'success': True,
+                        'stdout': memoized['stdout'],
+                        'stderr': memoized['stderr'],
+                        'input_files': available_files,
+                        'output_files': memoized['output_files'],
+                        'temp_dir': self.temp_dir,
+                        'staging': self.staging,
+                        'resources': {'wall_seconds': 0.0},
+                        'memoized': True
+                    }
+            
+            start = time.perf_counter()
+            try:
+                backend = 'kernel' if self.kernel is not None else 'pool' if self.use_pool else 'subprocess'
+                with span('code_run', backend=backend) as s:
+                    if self.kernel is not None:
+                        result = self.kernel.run(code, self.temp_dir, self.timeout, shared=self.shared_dataset(),
+                                                 cancel_event=self.cancel_event, limits=self.limits())
+                    elif self.use_pool:
+                        result = get_worker_pool().run(code, self.temp_dir, self.timeout, shared=self.shared_dataset(),
+                                                              cancel_event=self.cancel_event, limits=self.limits())
+                    else:
+                        result = self.run_in_subprocess(code)
+                    s.set(success=result['success'], **(result.get('resources') or {}))
                 
-                # Check for output files (CSV, etc.)
-                temp_files = []
-                for pattern in ["*.csv", "*.png", "*.pdf"]:#, "*.txt", "*.json", "*.xlsx"]:
-                    temp_files.extend(glob.glob(os.path.join(self.temp_dir, pattern)))
-                print("temp_files: ", temp_files)
-                output_files = []
-                for f in temp_files:
-                    filename = os.path.basename(f)
-                    if ".to_csv('"+filename in code or ".savefig('"+filename in code:
-                        output_files.append(filename)
-
+                # Output files: the files the code wrote in its directory, as recorded while it ran
+                output_files = manifest_outputs(result.get('written', []), self.temp_dir)
+                print("output_files: ", output_files)
+                if memo_key and result['success']:
+                    self.memo.store(memo_key, {**result, 'output_files': output_files}, self.temp_dir)
 
                 return {
-                    'success': result.returncode == 0,
-                    'stdout': result.stdout,
-                    'stderr': result.stderr,
+                    'success': result['success'],
+                    'stdout': result['stdout'],
+                    'stderr': result['stderr'],
                     'input_files': available_files,
-                    'output_files': [os.path.basename(f) for f in output_files],
-                    'temp_dir': self.temp_dir
+                    'output_files': output_files,
+                    'temp_dir': self.temp_dir,
+                    'staging': self.staging,
+                    'resources': result.get('resources') or {'wall_seconds': round(time.perf_counter() - start, 3)}
                 }
                 
-            except subprocess.TimeoutExpired:
+            except (subprocess.TimeoutExpired, TimeoutError):
                 return {
                     'success': False,
                     'stdout': '',
                     'stderr': f'Code execution timed out after {self.timeout} seconds',
                     'input_files': available_files,
                     'output_files': [],
-                    'temp_dir': self.temp_dir
+                    'temp_dir': self.temp_dir,
+                    'staging': self.staging,
+                    'resources': {'wall_seconds': round(time.perf_counter() - start, 3)}
                 }
-            finally:
-                try:
-                    os.unlink(temp_script)
-                except:
-                    pass
                     
         except Exception as e:
             return {
@@ -182,69 +501,115 @@ with open("{temp_script}", "r") as f:
                 'temp_dir': self.temp_dir
             }
         
-    def execute_safe(self, llm_response):
-        """Main method to safely execute code from LLM response"""
+    def max_parallel_blocks(self):
+        if self.use_pool:
+            return get_worker_pool().size
+        return os.cpu_count() or 1
+    
+    def execute_block(self, i, code, extra_inputs=None):
+        """Execute one code block in its own temporary directory (on a copy of the executor, so blocks can run concurrently)"""
+        print(f"\n--- Executing Code Block {i+1} ---")
+        print(f"Code:\n{code}\n")
+        block_executor = copy.copy(self)
+        with span('code_block', index=i) as s:
+            execution_result = block_executor.execute_with_inputs(code, copy_all_inputs=True, extra_inputs=extra_inputs)
+            s.set(success=execution_result['success'], memoized=execution_result.get('memoized', False))
+        execution_result['block_index'] = i
+        
+        # Print results
+        if execution_result['success']:
+            print(f"✅ Block {i+1} succeeded!")
+            if execution_result['stdout']:
+                print(f"Output: {execution_result['stdout']}")
+                print(f"Output files: {execution_result['output_files']}")
+        else:
+            print(f"❌ Block {i+1} failed!")
+            if execution_result['stderr']:
+                print(f"Error: {execution_result['stderr']}")
+        return execution_result
+    
+    def execute_safe(self, llm_response, skip_blocks=0, cancel_event=None, previous_results=None):
+        """
+        Main method to safely execute code from LLM response.
+        Blocks that don't depend on each other's files run concurrently; a block that reads files written by
+        earlier blocks runs after them, with their outputs staged as inputs. Results are returned in block order.
+        skip_blocks: number of leading code blocks that were already executed (e.g. while the response was streaming)
+        cancel_event: optional threading.Event, execution stops when it is set
+        previous_results: results of the skipped blocks, so their output files can be staged for the blocks that use them
+        (their temporary directories must still exist)
+        """
+        self.cancel_event = cancel_event
         print('Extracting code')
-        results = []
         
         # Extract code blocks
-        code_blocks = self.extract_code_blocks(llm_response)
+        all_blocks = self.extract_code_blocks(llm_response)
+        code_blocks = all_blocks[skip_blocks:]
         for cb in code_blocks:
             print(cb)
         
         if not code_blocks:
             return []#{'error': 'No code blocks found in response'}
         
-        for i, code in enumerate(code_blocks):
-            print(f"\n--- Executing Code Block {i+1} ---")
-            print(f"Code:\n{code}\n")
-            
-            # Validate syntax
+        # results of all blocks, by block index: the skipped blocks as given, the others as they finish #
+        results = [None] * len(all_blocks)
+        for r in previous_results or []:
+            if r and r.get('block_index') is not None and r['block_index'] < skip_blocks:
+                results[r['block_index']] = r
+        runnable = []
+        for i, code in enumerate(code_blocks, start=skip_blocks):
+            # Validate syntax, and check for dangerous operations
             is_valid, error = self.validate_code(code)
+            if is_valid:
+                is_valid, error = self.check_dangerous_imports(code)
             if not is_valid:
-                result = {
-                    'block_index': i,
-                    'success': False,
-                    'error': error,
-                    'stdout': '',
-                    'stderr': error
-                }
-                results.append(result)
-                continue
-            
-            # Check for dangerous operations
-            is_safe, error = self.check_dangerous_imports(code)
-            if not is_safe:
-                result = {
+                results[i] = {
                     'block_index': i,
                     'success': False,
                     'error': error,
                     'stdout': '',
                     'stderr': error
                 }
-                results.append(result)
-                continue
-            execution_result = self.execute_with_inputs(code, copy_all_inputs=True)
-            execution_result['block_index'] = i
-            results.append(execution_result)
-            
-            # Print results
-            if execution_result['success']:
-                print(f"✅ Success!")
-                if execution_result['stdout']:
-                    print(f"Output: {execution_result['stdout']}")
-                    print(f"Output files: {execution_result['output_files']}")
-                    # for fn in execution_result['output_files']:
-                    #     if not fn in execution_result['input_files']:
-                    #         source_path = os.path.join(self.temp_dir, fn)
-                    #         dest_path = os.path.join(self.input_directory, fn)
-                    #         shutil.copy2(source_path, dest_path)
             else:
-                print(f"❌ Failed!")
-                if execution_result['stderr']:
-                    print(f"Error: {execution_result['stderr']}")
+                runnable.append(i)
         
+        # blocks are run in waves: a block runs in the wave after the last block it depends on (skipped blocks are done) #
+        dependencies = self.block_dependencies(all_blocks)
+        wave = {}
+        for i in range(len(all_blocks)):
+            wave[i] = -1 if i < skip_blocks else 1 + max((wave[d] for d in dependencies[i]), default=-1)
+        waves = {}
+        for i in runnable:
+            waves.setdefault(wave[i], []).append(i)
+        
+        with ThreadPoolExecutor(max_workers=self.max_parallel_blocks()) as pool:
+            for level in sorted(waves):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                futures = {}
+                for i in waves[level]:
+                    futures[i] = pool.submit(contextvars.copy_context().run, self.execute_block, i,
+                                             all_blocks[i], self.predecessor_outputs(all_blocks[i], dependencies[i], results))
+                for i, future in futures.items():
+                    results[i] = future.result()
+        
+        results = [r for r in results[skip_blocks:] if r is not None]
+        executed = [r['temp_dir'] for r in results if r.get('temp_dir')]
+        if executed:
+            self.temp_dir = executed[-1]
         return results
+    
+    def predecessor_outputs(self, code, dependencies, results):
+        """Files written by earlier blocks that the code refers to, as {file name: path}"""
+        referenced, _ = self.file_references(code)
+        outputs = {}
+        for d in sorted(dependencies):
+            r = results[d]
+            if not r or not r.get('temp_dir'):
+                continue
+            for fn in r.get('output_files', []):
+                if os.path.basename(fn) in referenced:
+                    outputs[fn] = os.path.join(r['temp_dir'], fn)
+        return outputs
             
     def cleanup(self):
         """Clean up temporary directory"""
@@ -256,6 +621,35 @@ with open("{temp_script}", "r") as f:
                 print(f"⚠️  Could not clean up temp directory")
 
 
+def move_file(source_path, dest_path):
+    """Move a file so that dest_path is replaced atomically, also across file systems (then via a copy next to it)"""
+    os.makedirs(os.path.dirname(dest_path) or '.', exist_ok=True)
+    try:
+        os.replace(source_path, dest_path)
+    except OSError: # different file systems
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(dest_path) or '.', prefix='.moving_')
+        os.close(fd)
+        try:
+            shutil.copy2(source_path, temp_path)
+            os.replace(temp_path, dest_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        os.unlink(source_path)
+
+
+def publish_outputs(result, destination):
+    """Move the output files of an execution result from its temporary directory to destination. Returns their names."""
+    published = []
+    with span('output_move', files=len(result.get('output_files', []))):
+        for fn in result.get('output_files', []):
+            dest_path = os.path.join(destination, fn)
+            move_file(os.path.join(result['temp_dir'], fn), dest_path)
+            os.chmod(dest_path, os.stat(dest_path).st_mode | stat.S_IWUSR) # outputs staged for later blocks were made read-only
+            published.append(fn)
+    return published
+
+
 # Example usage
 if __name__ == "__main__":
     # Create some sample input files for testing
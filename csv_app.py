@@ -2,15 +2,29 @@ import streamlit as st
 import pandas as pd
 import os
 import shutil
-import json
+import time
+import uuid
 from langchain.memory import StreamlitChatMessageHistory
 from langchain_core.messages.base import BaseMessage
-from langchain_openai import ChatOpenAI
 import openai
-import jsonlines
-from code_exec import SafeCodeExecutorWithInputs
-from summarize_csv import summarize_csv
+from concurrent.futures import CancelledError
+from code_exec import SafeCodeExecutorWithInputs, publish_outputs, get_session_kernel
+from execution_cache import ExecutionCache
+from sql_engine import DuckDBExecutor, sql_available, TABLE_NAME
+from response_cache import ResponseCache
+from disk_cache import file_fingerprint
+from summarize_csv import summarize_csv, load_working_file, file_reader
 from streamlit_float import *
+from table_view import show_table
+from result_store import FrameCache, ResultChanged, make_handle
+from resources import make_llm_client, DatasetCatalog, DescriptionStore
+from job_queue import JobQueue, JobQueueFull
+import tracing
+from tracing import span
+from interaction_log import InteractionLog, summarize_spans
+from prompt_builder import PromptBuilder
+from prompts import template, sql_template, retry_template, insights_template, values_section
+from value_index import ValueIndex, index_file_name, describe_matches
 
 st.set_page_config(layout="wide")
 
@@ -22,67 +36,62 @@ if not os.path.exists('data'):
 
 ### The LLM ###
 apikey = os.environ["OPENAI_API_KEY"] #set this as an environment variable on your machine
-gpt4 = ChatOpenAI(model_name="gpt-4o", temperature=0, api_key=apikey) 
-#or caching for efficient deployment
-#@st.cache_resource 
-#def load_gpt4():
-    #return ChatOpenAI(model_name="gpt-4o", temperature=0, api_key=apikey) 
-#gpt4 = load_gpt4()    
+# cached for efficient deployment: one client (and HTTP connection pool) for all sessions and reruns #
+@st.cache_resource 
+def load_gpt4():
+    return make_llm_client(apikey, model_name="gpt-4o")
+gpt4 = load_gpt4()    
+
+# Answers with working code are cached, so repeated questions skip the LLM call. 
+# With SEMANTIC_CACHE, differently phrased questions with the same meaning (according to embeddings) also hit the cache.
+SEMANTIC_CACHE = False
+@st.cache_resource
+def load_response_cache():
+    embed = None
+    if SEMANTIC_CACHE:
+        from langchain_openai import OpenAIEmbeddings
+        embed = OpenAIEmbeddings(model="text-embedding-3-small", api_key=apikey).embed_query
+    return ResponseCache(embed=embed)
+response_cache = load_response_cache()
+
+# Spans of the stages of every interaction go to a json lines file, and optionally to a Prometheus endpoint (METRICS_PORT) #
+TRACES_FILE = os.environ.get('TRACES_FILE', 'traces.jsonl')
+@st.cache_resource
+def setup_tracing(): # returns the collector of the spans per interaction, for the interaction log
+    tracing.add_exporter(tracing.JsonLinesExporter(TRACES_FILE))
+    if os.environ.get('METRICS_PORT'):
+        tracing.add_exporter(tracing.PrometheusExporter()).serve(int(os.environ['METRICS_PORT']))
+    return tracing.add_exporter(tracing.InteractionCollector())
+span_collector = setup_tracing()
+
+# Interactions are logged by a background writer (batched, rotated and compressed) for future analysis #
+@st.cache_resource
+def get_interaction_log():
+    return InteractionLog('interaction_data.jsonl')
+
+# Results of code that ran before on the same input files are reused, also across sessions #
+@st.cache_resource
+def load_execution_cache():
+    return ExecutionCache()
+
+# Code runs as a job in a bounded queue that is shared by all sessions, one job per session at a time, #
+# so the app stays responsive and a running query can be cancelled #
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(max_workers=4, max_pending=32, per_session_limit=1)
+
+
+### LLM call templates (in prompts.py) ###
+# The prompts are kept within a token budget: the columns that match the question best get a full description, #
+# the conversation and error messages are truncated #
+PROMPT_MAX_TOKENS = 6000
+HISTORY_MAX_TOKENS = 1500
+RETRY_ERRORS_MAX_TOKENS = 1000
+@st.cache_resource
+def load_prompt_builder():
+    return PromptBuilder(max_tokens=PROMPT_MAX_TOKENS, history_tokens=HISTORY_MAX_TOKENS)
+prompt_builder = load_prompt_builder()
 
-
-### LLM call templates ###
-
-template = """
-You are an bot that writes python code to filter csv data, using pandas, and can answer questions about the dataset, including making plots.
-
-The dataset is provided in the following file: {filepath}
-
-Here is a summary of the data:
-
-<summary>
-{data_summary}
-</summary>
-
-Write code that performs the filtering requested by the user and writes the result to a new file. If any plots are generated, make sure these are also written to files. Do not show the plots.
-CRITICAL: Always wrap code in <code language="python">...</code> HTML tags. Never leave code untagged. 
-
-
-Preceeding conversation:
-{conversation}
-
-User query: {question}
-Explanation and code:"""
-
-
-retry_template = """The code you wrote did not run correctly. Try again.
-
-User query: {question}
-
-Generated answer: {answer}
-
-Errors: {errors}
-
-"""
-
-insights_template = """
-
-Summary of the full dataset: 
-<summary>
-{original_summary}
-</summary>
-
-User query: {question}
-
-Generated answer: 
-{answer}
-
-Summary of resulting dataset: 
-<summary>
-{new_summary}
-</summary>
-
-Provide relevant insights about the filtered data
-"""
 ### Management of session state variables for button behavior ###
 
 if 'input_data' not in st.session_state:
@@ -107,31 +116,115 @@ if 'user_input' not in st.session_state:
 if 'outfiles' not in st.session_state:
     st.session_state.outfiles = []
 
+if 'session_id' not in st.session_state: # identifies the session in shared caches
+    st.session_state.session_id = uuid.uuid4().hex
+
 def hide_buttons(ex=''):
     st.session_state.clicked2 = True
     st.session_state.chosen_example = ex
 
 ### Other variables relevant for the whole session ###
 msgs = StreamlitChatMessageHistory(key="langchain_messages")
+
+@st.cache_resource
+def get_frame_cache(): # result data frames of all sessions, loaded on demand and bounded in memory
+    return FrameCache()
+
+def show_result(handle, key): # display a result file referenced from the message history
+    try:
+        df = get_frame_cache().load(st.session_state.session_id, handle)
+    except OSError: # the file is gone, only the preview is left
+        st.caption(f"{os.path.basename(handle['path'])} is no longer available, preview of {handle['rows']} rows:")
+        df = pd.DataFrame(handle['preview'])
+    except ResultChanged: # a later result was written to the same file
+        st.caption(f"{os.path.basename(handle['path'])} has changed since this answer, preview of its {handle['rows']} rows then:")
+        df = pd.DataFrame(handle['preview'])
+    show_table(df, key=key)
+
 working_file = ''
 data_summary = ''
+value_index = ValueIndex() # distinct values of the text columns of the working file, see value_index
 input_dir = 'original_data'
 datadir = 'data' # working file and filtering results will be stored here
-datasets = []
-for fn in os.listdir(input_dir):
-    datasets.append(os.path.join(input_dir, fn))
+engine = 'pandas' # 'pandas' (generated python code) or 'sql' (generated DuckDB queries)
+use_kernel = False # run the python code in a persistent kernel of the session, which keeps its variables
+SQL_AUTO_MIN_BYTES = 500 * 1024**2 # in auto mode, datasets larger than this use the SQL engine
+EXEC_DIR = os.path.join('cache', 'exec') # execution directories, on the same file system as data, so outputs are moved instead of copied
+@st.cache_resource
+def load_catalog(): # refreshed when files are added to or removed from the input directory
+    return DatasetCatalog(input_dir)
+datasets = load_catalog().list()
 
 
 ### Functions that support the main interaction, e.g. for callilng the LLM and making sure the generated code gets executed, and results get passed back ###
 
 def display_code(response):
     response = response.replace('<code language="python">', '```python')
+    response = response.replace('<code language="sql">', '```sql')
     response = response.replace('</code>', '```') #this format gets displayed as a pretty code block in streamlit
     return response
 
-def execute_code(ai_answer): #this fuction uses the code execution functionality provided in 'code_exec.py' to extract and run the code from the ai_answer
-    executor = SafeCodeExecutorWithInputs(timeout=100, max_memory_mb=500, input_directory=datadir)
-    results = executor.execute_safe(ai_answer)
+def choose_engine(choice, input_file):
+    # the SQL engine pays off for large datasets: queries run in-process, multi-threaded, and can spill to disk #
+    if not sql_available() or choice == 'pandas':
+        return 'pandas'
+    if choice == 'SQL' or os.path.getsize(input_file) > SQL_AUTO_MIN_BYTES:
+        return 'sql'
+    return 'pandas'
+
+def make_executor():
+    if engine == 'sql':
+        return DuckDBExecutor(input_directory=datadir, working_file=working_file, timeout=100)
+    return SafeCodeExecutorWithInputs(timeout=100, max_memory_mb=500, input_directory=datadir, working_file=working_file,
+                                      temp_root=EXEC_DIR, memo=load_execution_cache(),
+                                      kernel=get_session_kernel(st.session_state.session_id) if use_kernel else None)
+
+def kernel_state(): # tells the LLM which variables of earlier code it can use
+    if engine != 'pandas' or not use_kernel:
+        return ''
+    variables = get_session_kernel(st.session_state.session_id).variables()
+    if not variables:
+        return "\nThe code runs in a persistent session: the dataset is already loaded as df, and variables you define stay available for follow-up questions.\n"
+    return ("\nThe code runs in a persistent session. These variables from previous code are still in memory and can be used directly "
+            "(df is the dataset, it may have been modified by previous code):\n<variables>\n" + variables + "\n</variables>\n")
+
+def cancel_job(job_id):
+    get_job_queue().cancel(job_id)
+
+def submit_job(fn, *args, **kwargs):
+    try:
+        return get_job_queue().submit(st.session_state.session_id, fn, *args, **kwargs)
+    except JobQueueFull as e:
+        st.error(str(e))
+        st.stop()
+
+def wait_for_job(job): # shows the progress of a job, with a button to cancel it, and returns its result
+    with st.status('Running code...') as status:
+        st.button('Cancel', key=f'cancel_{job.id}', on_click=cancel_job, args=(job.id,))
+        while not job.done():
+            label = 'Waiting for a free worker...' if job.status == 'queued' else f'Running code... ({job.elapsed():.0f} s)'
+            status.update(label=label)
+            time.sleep(0.25)
+        status.update(label=f'Code finished ({job.elapsed():.1f} s)', state='complete')
+    try:
+        return job.result()
+    except CancelledError:
+        st.warning('The code execution was cancelled.')
+        st.stop()
+
+def execute_code(ai_answer, early_execution=None): #this fuction uses the code execution functionality provided in 'code_exec.py' (or 'sql_engine.py') to extract and run the code from the ai_answer
+    # early_execution: (number of blocks, job with their results) for code blocks that were started while the answer was streaming #
+    results = []
+    skip_blocks = 0
+    with span('execute', engine=engine) as s:
+        if early_execution:
+            skip_blocks, early_job = early_execution
+            results.extend(wait_for_job(early_job))
+        executor = make_executor()
+        # the early results are passed on, so later blocks can use the files written by the early ones #
+        results.extend(wait_for_job(submit_job(executor.execute_safe, ai_answer, skip_blocks=skip_blocks,
+                                               previous_results=list(results))))
+        s.set(blocks=len(results), early_blocks=skip_blocks)
     outfiles = []
     print_output =[]
     errors = []
@@ -139,26 +232,45 @@ def execute_code(ai_answer): #this fuction uses the code execution functionality
         for r in results:
             print(r)
             if r:
-                outfiles.extend(r.get('output_files'))
+                outfiles.extend(r.get('output_files', []))
                 print_output.append(r.get('stdout'))
                 error = r.get('stderr')
                 if error:
                     errors.append(error)
-        for fn in os.listdir(executor.temp_dir): #copy output files from temporary directory to data for easier and contiued accessibility
-                print(fn)
-                if fn in outfiles:
+                for fn in publish_outputs(r, datadir): #move output files from temporary directory to data for easier and contiued accessibility
+                    print(fn)
                     st.session_state.outfiles.append(fn)
-                    source_path = os.path.join(executor.temp_dir, fn)
-                    dest_path = os.path.join(datadir, fn)
-                    shutil.copy2(source_path, dest_path)
+        for temp_dir in set(r['temp_dir'] for r in results if r and r.get('temp_dir')): # every block runs in its own temporary directory
+            shutil.rmtree(temp_dir, ignore_errors=True)
     executor.cleanup()
     return print_output, outfiles, errors
 
 
+def stream_answer(full_prompt, ai_placeholder):
+    # The answer is shown while it is being generated, and the first complete code block(s) start running right away, in the background. #
+    ai_answer = ''
+    early_execution = None
+    executor = make_executor()
+    with span('llm_call', prompt_tokens=prompt_builder.count_tokens(full_prompt)) as s:
+        for chunk in gpt4.stream(full_prompt):
+            if not ai_answer:
+                s.set(first_token_seconds=round(time.time() - s.start, 3))
+            ai_answer += chunk.content
+            ai_placeholder.markdown(display_code(ai_answer) + ' ▌')
+            if early_execution is None:
+                n_blocks = len(executor.extract_code_blocks(ai_answer))
+                if n_blocks:
+                    early_execution = (n_blocks, submit_job(executor.execute_safe, ai_answer))
+        s.set(answer_chars=len(ai_answer))
+    ai_placeholder.markdown(display_code(ai_answer))
+    return ai_answer, early_execution
+
+
 def retry_generation(user_input, ai_answer, errors):
-    with st.spinner('Trying again...'):
+    with st.spinner('Trying again...'), span('retry'):
         try:
-            retry_prompt = retry_template.format(question=user_input, answer=ai_answer, errors=errors)
+            errors_text = prompt_builder.truncate('\n'.join(errors), RETRY_ERRORS_MAX_TOKENS, keep='tail') # the end of a traceback says most
+            retry_prompt = retry_template.format(question=user_input, answer=ai_answer, errors=errors_text)
             result = gpt4.invoke(retry_prompt)
             ai_answer = result.content
         except ValueError:
@@ -170,27 +282,55 @@ def retry_generation(user_input, ai_answer, errors):
     return ai_answer, print_output, outfiles, new_errors
 
 
-def act_on_input(user_input): # This function takes care of the main LLM call
-    st.chat_message("human").write(user_input) # the user input is displayed 
-    prev_conv = '\n'.join([msg.type+': '+msg.content for msg in msgs.messages[-4:]]) # the previous two interactions are retrieved from the message history and provided as context
+def act_on_input(user_input, ai_placeholder): # This function takes care of the main LLM call, the answer is streamed into ai_placeholder
+    prev_messages = [(msg.type, msg.content) for msg in msgs.messages[-4:]] # the previous two interactions are retrieved from the message history and provided as context
+    prev_conv = '\n'.join([kind+': '+content for kind, content in prev_messages])
     user_msg = BaseMessage(type="human", content=user_input) # the user input is added to the message history
     msgs.add_message(user_msg)
-    with st.spinner('Generating...'): # a spinner is shown while the LLM is working
+    # an answer with working code for the same question, on the same data and with the same preceding conversation, can be reused #
+    state = kernel_state()
+    context_key = response_cache.context_key(file_fingerprint(os.path.join(datadir, working_file)), data_summary, prev_conv, [engine, state])
+    with span('response_cache_lookup') as s:
+        cached_answer, cache_key = response_cache.lookup(context_key, user_input)
+        s.set(hit=bool(cached_answer))
+    if cached_answer:
+        print('Using cached answer')
+        print_output, outfiles, errors = execute_code(cached_answer)
+        if not errors:
+            if print_output:
+                cached_answer = cached_answer+'  \n\n'+'\n'.join(print_output)
+            return cached_answer, print_output, outfiles, errors
+        response_cache.invalidate(cache_key) # the code does not work anymore, so generate a new answer
+    # values from the question that occur in the data are linked to their columns, so the LLM doesn't have to guess #
+    with span('value_lookup') as s:
+        value_lines = describe_matches(value_index.lookup(user_input))
+        s.set(matches=len(value_lines))
+    values = values_section(value_lines)
+    early_execution = None
+    with st.spinner('Generating...'): # a spinner is shown until the LLM is done
         try:
             # the name of the input file, data summary and previous interactions are provided to the LLM, together with user input and the instructions provided in the template. #
-            full_prompt = template.format(question=user_input, filepath=working_file, data_summary=data_summary, conversation=prev_conv)
+            if engine == 'sql':
+                full_prompt = prompt_builder.build(sql_template, user_input, info, column_info, extra_info, prev_messages,
+                                                   filepath=working_file, table=TABLE_NAME, values=values)
+            else:
+                full_prompt = prompt_builder.build(template, user_input, info, column_info, extra_info, prev_messages,
+                                                   filepath=working_file, reader=file_reader(working_file), state=state,
+                                                   values=values)
             print(full_prompt)
-            result = gpt4.invoke(full_prompt)
-            ai_answer = result.content
+            ai_answer, early_execution = stream_answer(full_prompt, ai_placeholder)
         except ValueError:
             ai_answer = ''
     if not ai_answer: # in a previous project it has happened that the answer triggered some filter and was not returned
         st.write('Oops, something went wrong. Please try again.')
+        return '', [], [], []
     else:
-        print_output, outfiles, errors = execute_code(ai_answer) # code (if any) is extracted and executed
+        print_output, outfiles, errors = execute_code(ai_answer, early_execution) # code (if any) is extracted and executed
         # One retry if the generated code throws an error. Not yet tested. If there are still errors after that, we return the answer with errors. The user can then maybe reformulate their request to help the LLM. #
         if errors:
             ai_answer, print_output, outfiles, errors = retry_generation(user_input, ai_answer, errors) 
+        if ai_answer and not errors:
+            response_cache.store(context_key, user_input, ai_answer)
         # add any print output from running the code to the answer, so it gets displayed (and goes into the message history) as part of the answer  #
         if ai_answer and not errors:
             if print_output:
@@ -200,21 +340,139 @@ def act_on_input(user_input): # This function takes care of the main LLM call
 
 ### Some placeholder functionality for providing user-friendly text descriptions of datasets ###
 # Users may alreay know this or need something different as an introduction to the loaded dataset. This is just an example.
-stored_descriptions = {}
-with open("stored_descriptions.json", 'r') as f:
-    data = json.load(f)
-    stored_descriptions = data
+@st.cache_resource
+def load_description_store(): # only reads the file again when it has changed
+    return DescriptionStore("stored_descriptions.json")
     
 def get_description(dataset):
     # Description is LLM generated, with minimal editing, based on csv summary. For efficiency reasons we don't want to generate a new description every time we load the dataset.
-    if dataset in stored_descriptions.keys():
-        description = stored_descriptions[dataset].get("description")
+    stored = load_description_store().get(dataset)
+    if stored:
+        description = stored.get("description")
     else:
         description = "Description needs to be generated"
         # Not yet added: Description generation and storage for new datasets. Prompt needs to be optimized for user needs. 
     return description
 
 
+### Rendering of the chat ###
+# The dataset and the history are drawn on a full rerun. New input only reruns the chat fragment, which draws the messages 
+# added since the last full rerun and the new turn, so the cost of an interaction doesn't grow with the history. #
+
+@st.cache_data(show_spinner=False)
+def prepare_dataset(input_file, mtime): # mtime is only there to invalidate the cache when the file changes
+    return summarize_csv(input_file, datadir)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_working_data(path, mtime):
+    return load_working_file(path)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def load_value_index(path, mtime):
+    return ValueIndex.load(path)
+
+def render_message(i, msg):
+    st.chat_message(msg.type).write(msg.content)
+    if msg.type == "ai" and hasattr(msg, "results"):
+        for j, handle in enumerate(msg.results):
+             show_result(handle, key=f'history_{i}_{j}')
+        for plot in msg.plots:
+             st.image(plot)
+
+def process_input(user_input): # one turn: the answer is generated, code executed and the results displayed
+    # all spans of the turn (also in background jobs) are tagged with the session and a new interaction id #
+    with tracing.context(session=st.session_state.session_id, interaction=uuid.uuid4().hex), span('interaction', engine=engine):
+        run_interaction(user_input)
+
+def run_interaction(user_input):
+    start = time.perf_counter()
+    st.chat_message("human").write(user_input) # the user input is displayed 
+    ai_placeholder = st.chat_message("ai").empty()
+    ai_answer, print_output, outfiles, errors = act_on_input(user_input, ai_placeholder) # this is wehre the main LLM call happens
+    display_answer = display_code(ai_answer) # modifying the answer to ensure that the code is displayed nicely in the UI
+    ai_placeholder.write(display_answer) # the final answer is displayed, including any print output
+    print(ai_answer)
+    ai_msg = BaseMessage(type="ai", content=display_answer) # a message is created for storing in the message history
+    interaction = {'interaction_id': tracing.interaction_id.get()} # some basic storage of interaction data for future analysis
+    interaction['user_input'] = user_input
+    interaction['ai_answer'] = ai_answer
+    # Display data frames from output files and store them in history #
+    if outfiles: # These are csv files. For other file types, e.g. plots, additional fuctionality is needed
+        interaction['output_files'] = outfiles
+        new_results = []
+        new_plots = []
+        for fn in outfiles:
+            dest_path = os.path.join(datadir, fn)
+            if fn.endswith('.csv'):
+                with span('result_load', file=fn):
+                    df = pd.read_csv(dest_path)
+                show_table(df, key=f'history_{len(msgs.messages)}_{len(new_results)}') # display any csv files that result from running the generated code (same key as when it is redisplayed from the history)
+                handle = make_handle(dest_path, df)
+                get_frame_cache().put(st.session_state.session_id, dest_path, df, handle['mtime'])
+                new_results.append(handle)
+            elif fn.endswith('.png') or fn.endswith('.pdf'):
+                st.image(dest_path)
+                new_plots.append(dest_path)
+        setattr(ai_msg, 'results', new_results) # add handles to the resulting files to the answer as a separate attribute, so they can continue to be displayed (the data frames are reloaded when needed)
+        setattr(ai_msg, 'plots', new_plots)
+        msgs.add_message(ai_msg) 
+    print('current outfiles: ', outfiles)
+    # Display any errors resulting from running the code #
+    if errors:
+        st.markdown('  \n'.join(errors))
+        print('  \n'.join(errors))
+        interaction['errors'] = errors
+    # Small experiment to let the LLM comment on the output. Not very useful yet. Adding business objectives to the instructions might be good here. #
+    # if outfiles:
+    #     info, column_info, extra_info, output_file = summarize_csv(os.path.join(datadir, outfiles[0]), datadir)
+    #     new_summary = '  \n'.join(['  \n'.join(info), '  \n'.join(column_info)])
+    #     with st.spinner('Generating insights...'):
+    #         try:
+    #             prompt = insights_template.format(question=user_input, answer=ai_answer, original_summary=data_summary,  new_summary=new_summary)
+    #             print(prompt)
+    #             result = gpt4.invoke(prompt)
+    #             ai_insights = result.content
+    #         except ValueError:
+    #             ai_insights = ''
+    #         if ai_insights:
+    #             print(ai_insights)
+    #             st.chat_message("ai").write(ai_insights)
+    #             interaction['ai_insights'] = ai_insights
+    # collect data in a file for future reference, with the time spent per stage and the resources used by the code #
+    interaction['session_id'] = st.session_state.session_id
+    interaction['timestamp'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+    interaction['seconds'] = round(time.perf_counter() - start, 3)
+    interaction['timings'], interaction['resources'] = summarize_spans(span_collector.pop(interaction['interaction_id']))
+    get_interaction_log().write(interaction)
+
+
+@st.fragment
+def chat_area():
+    for i in range(st.session_state.get('rendered_messages', 0), len(msgs.messages)):
+        render_message(i, msgs.messages[i])
+    # The user can provide input by chosing an example, or by typing in the input field #
+    if len(msgs.messages) == 0 and not st.session_state.clicked2: #examples are displayed intitially to get the user started
+        st.markdown("You can ask to filter this data using natural language, for example:")
+        examples = ["Show me data for Aarhus", "Give me the returning customers", "Show the jackets sold on weekend days"]
+        for ex in examples:
+            st.button(ex, on_click=hide_buttons, args=[ex])
+    container = st.container()
+    if st.session_state.clicked2:
+        container.float(css=float_css_helper(width="2.2rem", bottom="3rem", transition=0))
+    with container:
+        st.chat_input(key='content', on_submit=hide_buttons)
+    if st.session_state.chosen_example:
+        st.session_state.user_input = st.session_state.chosen_example
+        st.session_state.chosen_example = ''
+    if content:=st.session_state.content:
+        st.session_state.user_input = st.session_state.content
+    # Once user input has been entered, the LLM will be called to generate a response #
+    if st.session_state.user_input:
+        user_input = st.session_state.user_input
+        st.session_state.user_input = ''
+        process_input(user_input)
+
+
 ### The actual interaction ###
 
 # Title and initial message #
@@ -234,14 +492,22 @@ if st.session_state.input_data: #This session state variable gets its value, whe
     st.markdown("You have chosen to load:")
     st.markdown("**"+os.path.basename(input_file)+"**") # display the file name of the selected dataset
     # summarize_csv (imported from separate file) creates the csv file were are going to display and work with (removing less informative columns for better readability) and the information needed for a data summary that we will feed to the LLM #
-    info, column_info, extra_info, output_file = summarize_csv(input_file, datadir) 
+    info, column_info, extra_info, output_file = prepare_dataset(input_file, os.path.getmtime(input_file)) 
     working_file = output_file # this is going to be the input file for the generated scripts throughout the session
+    engine_choice = st.sidebar.radio("Execution engine", ['Auto', 'pandas', 'SQL'], disabled=not sql_available(),
+                                     help="Auto uses SQL (DuckDB) for large datasets and pandas code otherwise")
+    engine = choose_engine(engine_choice, input_file)
+    use_kernel = engine == 'pandas' and st.sidebar.toggle("Keep variables between questions", value=False,
+                                                          help="Follow-up questions can then work on earlier (filtered) results in memory")
     # display a text description of the selected dataset #
     description = get_description(os.path.basename(input_file)) 
     st.markdown(description)
     # display the data in streamlit and prepare the data summary for the LLM #
-    df = pd.read_csv(os.path.join(datadir, working_file))
-    st.dataframe(df, use_container_width=True)
+    working_path = os.path.join(datadir, working_file)
+    df = load_working_data(working_path, os.path.getmtime(working_path))
+    show_table(df, key='working_data')
+    index_path = os.path.join(datadir, index_file_name(working_file))
+    value_index = load_value_index(index_path, os.path.getmtime(index_path) if os.path.exists(index_path) else None)
     data_summary = '  \n'.join(['  \n'.join(info), '  \n'.join(column_info)])
     if extra_info:
         st.markdown("The following colums have been removed:")
@@ -249,83 +515,7 @@ if st.session_state.input_data: #This session state variable gets its value, whe
         data_summary = data_summary + "The following colums have been removed:  \n\n" + '  \n'.join(extra_info)
 
     # Display of previous interactions #
-    for msg in msgs.messages:
-        st.chat_message(msg.type).write(msg.content)
-        if msg.type == "ai" and hasattr(msg, "data_frames"):
-            for df in msg.data_frames:
-                 st.dataframe(df, use_container_width=True)
-            for plot in msg.plots:
-                 st.image(plot)
-
-    # The user can provide input by chosing an example, or by typing in the input field #
-    if len(msgs.messages) == 0 and not st.session_state.clicked2: #examples are displayed intitially to get the user started
-        st.markdown("You can ask to filter this data using natural language, for example:")
-        examples = ["Show me data for Aarhus", "Give me the returning customers", "Show the jackets sold on weekend days"]
-        for ex in examples:
-            st.button(ex, on_click=hide_buttons, args=[ex])
-    container = st.container()
-    if st.session_state.clicked2:
-        container.float(css=float_css_helper(width="2.2rem", bottom="3rem", transition=0))
-    with container:
-        st.chat_input(key='content', on_submit=hide_buttons)
-    if st.session_state.chosen_example:
-        st.session_state.user_input = st.session_state.chosen_example
-        st.session_state.chosen_example = ''
-    if content:=st.session_state.content:
-        st.session_state.user_input = st.session_state.content
-    # Once user input has been entered, the LLM will be called to generate a response #
-    if st.session_state.user_input:
-        user_input = st.session_state.user_input
-        st.session_state.user_input = ''
-        ai_answer, print_output, outfiles, errors = act_on_input(user_input) # this is wehre the main LLM call happens
-        display_answer = display_code(ai_answer) # modifying the answer to ensure that the code is displayed nicely in the UI
-        st.chat_message("ai").write(display_answer) # the answer is displayed
-        print(ai_answer)
-        ai_msg = BaseMessage(type="ai", content=display_answer) # a message is created for storing in the message history
-        interaction = {} # some basic storage of interaction data for future analysis
-        interaction['user_input'] = user_input
-        interaction['ai_answer'] = ai_answer
-        # Display data frames from output files and store them in history #
-        if outfiles: # These are csv files. For other file types, e.g. plots, additional fuctionality is needed
-            interaction['output_files'] = outfiles
-            new_dfs = []
-            new_plots = []
-            for fn in outfiles:
-                dest_path = os.path.join(datadir, fn)
-                if fn.endswith('.csv'):
-                    df = pd.read_csv(dest_path)
-                    st.dataframe(df, use_container_width=True) # display any csv files that result from running the generated code
-                    new_dfs.append(df)
-                elif fn.endswith('.png') or fn.endswith('.pdf'):
-                    st.image(dest_path)
-                    new_plots.append(dest_path)
-            setattr(ai_msg, 'data_frames', new_dfs) # add the resulting dataframes to the answer as a separate attribute, so they can continue to be displayed
-            setattr(ai_msg, 'plots', new_plots)
-            msgs.add_message(ai_msg) 
-        print('current outfiles: ', outfiles)
-        # Display any errors resulting from running the code #
-        if errors:
-            st.markdown('  \n'.join(errors))
-            print('  \n'.join(errors))
-            interaction['errors'] = errors
-        # Small experiment to let the LLM comment on the output. Not very useful yet. Adding business objectives to the instructions might be good here. #
-        # if outfiles:
-        #     info, column_info, extra_info, output_file = summarize_csv(os.path.join(datadir, outfiles[0]), datadir)
-        #     new_summary = '  \n'.join(['  \n'.join(info), '  \n'.join(column_info)])
-        #     with st.spinner('Generating insights...'):
-        #         try:
-        #             prompt = insights_template.format(question=user_input, answer=ai_answer, original_summary=data_summary,  new_summary=new_summary)
-        #             print(prompt)
-        #             result = gpt4.invoke(prompt)
-        #             ai_insights = result.content
-        #         except ValueError:
-        #             ai_insights = ''
-        #         if ai_insights:
-        #             print(ai_insights)
-        #             st.chat_message("ai").write(ai_insights)
-        #             interaction['ai_insights'] = ai_insights
-        # collect data in a file for future reference #
-        with jsonlines.open('interaction_data.jsonl', mode='a') as writer: 
-            writer.write(interaction)
-        
-        
+    for i, msg in enumerate(msgs.messages):
+        render_message(i, msg)
+    st.session_state.rendered_messages = len(msgs.messages) # the chat fragment only has to draw messages after these
+    chat_area()
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+# Small on-disk cache shared by the app. Every entry is a directory named after its key,
+# holding 'entry.json' (the cached value) and optionally some attached files.
+# The mtime of 'entry.json' doubles as the last access time, which is used for LRU eviction.
+
+ENTRY_FILE = 'entry.json'
+
+
+def file_fingerprint(file_path, sample_bytes=1 << 20, samples=8):
+    """
+    Cheap content fingerprint of a file: size + mtime + hash of a few evenly spaced samples.
+    This avoids hashing multi-GB files completely, while still catching most content changes.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.sha1()
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(file_path, 'rb') as f:
+        if stat.st_size <= sample_bytes * samples:
+            digest.update(f.read())
+        else:
+            step = (stat.st_size - sample_bytes) // (samples - 1)
+            for i in range(samples):
+                f.seek(i * step)
+                digest.update(f.read(sample_bytes))
+    return digest.hexdigest()
+
+
+def make_key(*parts):
+    """Build a cache key from arbitrary (json serializable) parts"""
+    raw = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class DiskCache:
+    def __init__(self, root, max_bytes=2 * 1024**3, ttl=None):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl # in seconds, None means entries never expire
+        os.makedirs(self.root, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Return (value, entry_dir) for a cached key, or (None, None) on a miss"""
+        entry_dir = self._entry_dir(key)
+        entry_path = os.path.join(entry_dir, ENTRY_FILE)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(entry_path) > self.ttl:
+                self.delete(key)
+                return None, None
+            with open(entry_path, 'r') as f:
+                value = json.load(f)
+            os.utime(entry_path) # mark as recently used
+            return value, entry_dir
+        except (OSError, ValueError):
+            return None, None
+
+    def put(self, key, value, files=None):
+        """Store a value and copies of the given files (name -> source path) under key"""
+        entry_dir = self._entry_dir(key)
+        tmp_dir = entry_dir + f'.tmp{os.getpid()}-{threading.get_ident()}'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, source_path in (files or {}).items():
+            shutil.copy2(source_path, os.path.join(tmp_dir, name))
+        with open(os.path.join(tmp_dir, ENTRY_FILE), 'w') as f:
+            json.dump(value, f)
+        # swap the complete entry in, so readers never see a half written one
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError: # another process stored the same key in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+        return entry_dir
+
+    def delete(self, key):
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def entries(self):
+        """List (last_access, size, key) for all complete entries"""
+        entries = []
+        for key in os.listdir(self.root):
+            if '.tmp' in key: # entry that is still being written
+                continue
+            entry_dir = self._entry_dir(key)
+            entry_path = os.path.join(entry_dir, ENTRY_FILE)
+            try:
+                size = sum(os.path.getsize(os.path.join(entry_dir, fn)) for fn in os.listdir(entry_dir))
+                entries.append((os.path.getmtime(entry_path), size, key))
+            except OSError: # removed by another process in the meantime
+                pass
+        return entries
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones until the cache fits in max_bytes"""
+        entries = sorted(self.entries())
+        now = time.time()
+        total = sum(size for _, size, _ in entries)
+        for last_access, size, key in entries:
+            expired = self.ttl is not None and now - last_access > self.ttl
+            if expired or total > self.max_bytes:
+                self.delete(key)
+                total -= size
@@ -0,0 +1,106 @@
+import ast
+import hashlib
+import os
+import shutil
+from disk_cache import DiskCache, file_fingerprint, make_key
+
+# Memoized results of generated code. Retries, repeated questions and follow-ups often produce the same code
+# (up to formatting and comments) for the same inputs, so the result (stdout and output files) is stored on disk,
+# keyed by the normalized code and the fingerprints of the input files, and shared by all sessions.
+
+EXECUTION_CACHE_DIR = os.path.join('cache', 'executions')
+EXECUTION_CACHE_MAX_BYTES = 1024**3
+EXECUTION_CACHE_TTL = 7 * 24 * 3600
+# code that imports these modules can give a different result every time it runs
+NONDETERMINISTIC_MODULES = {'random', 'time', 'datetime', 'uuid', 'secrets'}
+# and calls of these functions and methods (e.g. df.sample(), np.random.rand(), pd.Timestamp.now()),
+# or these string arguments (e.g. pd.to_datetime('today'))
+NONDETERMINISTIC_CALLS = {'sample', 'random', 'rand', 'randn', 'randint', 'choice', 'shuffle', 'permutation',
+                          'default_rng', 'now', 'today', 'utcnow'}
+NONDETERMINISTIC_LITERALS = {'now', 'today'}
+
+
+def code_hash(code):
+    """Hash of the AST of the code, so formatting and comments don't matter. None if the code can't be parsed."""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    return hashlib.sha1(ast.dump(tree).encode()).hexdigest()
+
+
+def _called_name(node):
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    return None
+
+
+def is_deterministic(code):
+    """False if the code can give a different result on the same inputs: it uses randomness or the current time"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return False
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and _called_name(node) in NONDETERMINISTIC_CALLS:
+            return False
+        if isinstance(node, ast.Attribute) and node.attr == 'random': # np.random.<anything>
+            return False
+        if (isinstance(node, ast.Constant) and isinstance(node.value, str)
+                and node.value.strip().lower() in NONDETERMINISTIC_LITERALS):
+            return False
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules = [node.module or '']
+        else:
+            continue
+        if any(module.split('.')[0] in NONDETERMINISTIC_MODULES for module in modules):
+            return False
+    return True
+
+
+class ExecutionCache:
+    def __init__(self, cache_dir=EXECUTION_CACHE_DIR, max_bytes=EXECUTION_CACHE_MAX_BYTES, ttl=EXECUTION_CACHE_TTL):
+        self.cache = DiskCache(cache_dir, max_bytes=max_bytes, ttl=ttl)
+
+    def key(self, code, input_files, variant=None):
+        """
+        Cache key for running code with the given input files ({name: path}), or None if the result can't be reused.
+        variant: anything else that changes the result, e.g. the preloaded dataset
+        """
+        if not is_deterministic(code):
+            return None
+        code_key = code_hash(code)
+        if code_key is None:
+            return None
+        fingerprints = {name: file_fingerprint(path) for name, path in sorted(input_files.items())}
+        return make_key('execution', code_key, fingerprints, variant)
+
+    def lookup(self, key, directory):
+        """
+        Returns the stored result for key, with its output files placed in directory, or None.
+        The files are copied, not linked: they are published into the data directory, where later writes to them
+        must not change the cache entry.
+        """
+        value, entry_dir = self.cache.get(key)
+        if value is None:
+            return None
+        try:
+            for i, fn in enumerate(value['output_files']):
+                dest_path = os.path.join(directory, fn)
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                if os.path.lexists(dest_path): # e.g. a staged input, which is a link to a read-only snapshot
+                    os.unlink(dest_path)
+                shutil.copy2(os.path.join(entry_dir, f'output{i}'), dest_path)
+        except OSError: # evicted in the meantime
+            return None
+        return value
+
+    def store(self, key, result, directory):
+        """Store a successful result, with the output files from directory"""
+        files = {f'output{i}': os.path.join(directory, fn) for i, fn in enumerate(result['output_files'])}
+        value = {'stdout': result['stdout'], 'stderr': result['stderr'], 'output_files': result['output_files']}
+        self.cache.put(key, value, files=files)
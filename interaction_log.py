@@ -0,0 +1,138 @@
+import atexit
+import fcntl
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+# Log of the interactions (one json record per line; also used for the tracing spans), written by a background thread, so logging doesn't add
+# latency to the request. Records are batched and flushed every flush_interval seconds or max_batch records.
+# The file is rotated when it gets too large or on a new day; rotated files are gzip compressed.
+# Several server processes can share the log: writes and rotation happen under an exclusive flock.
+
+LOG_MAX_BYTES = 50 * 1024**2
+
+
+class InteractionLog:
+    def __init__(self, path='interaction_data.jsonl', flush_interval=2.0, max_batch=100, max_bytes=LOG_MAX_BYTES,
+                 rotate_daily=True, max_queue=10000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0 # records that didn't fit in the queue
+        self.thread = threading.Thread(target=self._run, name='interaction-log', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, record):
+        """Queue a record (a json serializable dict); never blocks"""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self, timeout=5):
+        """Write the queued records and stop the writer"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(timeout)
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        stopping = False
+        while not stopping:
+            try:
+                record = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                if record is None:
+                    stopping = True
+                else:
+                    batch.append(record)
+            except queue.Empty:
+                pass
+            if batch and (stopping or len(batch) >= self.max_batch or time.monotonic() >= deadline):
+                try:
+                    self._flush(batch)
+                except Exception as e: # logging must never break the app, the records are lost
+                    print(f"Could not write interaction log: {e}")
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+    def _open_locked(self):
+        """The log file, opened for appending and exclusively locked (reopened if another process rotated it)"""
+        while True:
+            f = open(self.path, 'a')
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                if os.fstat(f.fileno()).st_ino == os.stat(self.path).st_ino:
+                    return f
+            except FileNotFoundError:
+                pass
+            f.close() # rotated while waiting for the lock
+
+    def _flush(self, batch):
+        lines = ''.join(json.dumps(record, default=str) + '\n' for record in batch)
+        if self.dropped:
+            print(f"Interaction log: {self.dropped} records dropped, the queue was full")
+            self.dropped = 0
+        rotated = None
+        with self._open_locked() as f:
+            if self._should_rotate(f):
+                rotated = self._rotate()
+                f.close()
+                with self._open_locked() as new_file:
+                    new_file.write(lines)
+            else:
+                f.write(lines)
+        if rotated:
+            self._compress(rotated)
+
+    def _should_rotate(self, f):
+        stat = os.fstat(f.fileno())
+        if stat.st_size == 0:
+            return False
+        if stat.st_size >= self.max_bytes:
+            return True
+        return self.rotate_daily and time.strftime('%Y%m%d', time.localtime(stat.st_mtime)) != time.strftime('%Y%m%d')
+
+    def _rotate(self):
+        """Rename the current log (called with the lock held). Returns the new name."""
+        base, ext = os.path.splitext(self.path)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        n = 0
+        while True: # unique, also when the log is rotated more than once per second
+            rotated = f"{base}-{stamp}-{os.getpid()}-{n}{ext}"
+            if not os.path.exists(rotated) and not os.path.exists(rotated + '.gz'):
+                break
+            n += 1
+        os.rename(self.path, rotated)
+        return rotated
+
+    def _compress(self, path):
+        with open(path, 'rb') as source, gzip.open(path + '.gz.tmp', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(path + '.gz.tmp', path + '.gz')
+        os.unlink(path)
+
+
+def summarize_spans(spans):
+    """
+    Timing and resource metrics of an interaction, from its tracing spans (see tracing.InteractionCollector):
+    the seconds per stage, and the resources used by the executed code
+    """
+    timings = {}
+    for s in spans:
+        timings[s['name']] = round(timings.get(s['name'], 0) + s['seconds'], 4)
+    runs = [s['attributes'] for s in spans if s['name'] == 'code_run']
+    resources = {'code_runs': len(runs)}
+    for name in ['cpu_seconds', 'bytes_read', 'bytes_written']:
+        resources[name] = round(sum(run.get(name, 0) for run in runs), 3)
+    resources['peak_rss_mb'] = max((run.get('peak_rss_mb', 0) for run in runs), default=0)
+    return timings, resources
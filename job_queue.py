@@ -0,0 +1,118 @@
+import contextvars
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+# Bounded background queue for code execution jobs. The app submits a job and polls its status, instead of running
+# the code inside the Streamlit script. Every session can only have a limited number of jobs running at the same time,
+# further jobs of that session wait in the queue, so one user with slow queries can't take all the workers.
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, session, fn, args, kwargs):
+        self.id = job_id
+        self.session = session
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.context = contextvars.copy_context() # e.g. the session and interaction of tracing spans
+        self.status = 'queued' # queued, running, done, failed or cancelled
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.value = None
+        self.error = None
+        self.cancel_event = threading.Event() # checked by the executors while code is running
+        self.done_event = threading.Event()
+
+    def done(self):
+        return self.done_event.is_set()
+
+    def elapsed(self):
+        return (self.finished or time.time()) - (self.started or self.submitted)
+
+    def result(self, timeout=None):
+        """Wait for the job, like concurrent.futures.Future.result"""
+        if not self.done_event.wait(timeout):
+            raise TimeoutError(f'Job {self.id} is not finished')
+        if self.status == 'cancelled':
+            raise CancelledError()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class JobQueue:
+    def __init__(self, max_workers=4, max_pending=32, per_session_limit=1):
+        self.max_pending = max_pending # queued + running jobs, for all sessions together
+        self.per_session_limit = per_session_limit
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.waiting = {} # session -> deque of queued jobs
+        self.running = {} # session -> number of running jobs
+        self.ids = itertools.count(1)
+
+    def submit(self, session, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs), fn may accept a cancel_event keyword argument. Returns the Job."""
+        with self.lock:
+            active = sum(1 for job in self.jobs.values() if not job.done())
+            if active >= self.max_pending:
+                raise JobQueueFull('Too many queries are running, please try again in a moment')
+            job = Job(next(self.ids), session, fn, args, kwargs)
+            self.jobs[job.id] = job
+            self.waiting.setdefault(session, deque()).append(job)
+            self._dispatch(session)
+        return job
+
+    def _dispatch(self, session):
+        """Start waiting jobs of the session, as far as its limit allows (called with the lock held)"""
+        waiting = self.waiting.get(session)
+        while waiting and self.running.get(session, 0) < self.per_session_limit:
+            job = waiting.popleft()
+            self.running[session] = self.running.get(session, 0) + 1
+            job.status = 'running'
+            job.started = time.time()
+            self.pool.submit(self._run, job)
+
+    def _run(self, job):
+        try:
+            job.value = job.context.run(job.fn, *job.args, cancel_event=job.cancel_event, **job.kwargs)
+            job.status = 'cancelled' if job.cancel_event.is_set() else 'done'
+        except Exception as e:
+            job.error = e
+            job.status = 'failed'
+        job.finished = time.time()
+        with self.lock:
+            self.running[job.session] -= 1
+            self._forget_old_jobs()
+            self._dispatch(job.session)
+        job.done_event.set()
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or stop a running one"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.done():
+                return
+            job.cancel_event.set()
+            waiting = self.waiting.get(job.session)
+            if waiting and job in waiting:
+                waiting.remove(job)
+                job.status = 'cancelled'
+                job.finished = time.time()
+                job.done_event.set()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _forget_old_jobs(self, keep_seconds=3600):
+        now = time.time()
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.done() and now - job.finished > keep_seconds]:
+            del self.jobs[job_id]
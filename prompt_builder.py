@@ -0,0 +1,128 @@
+import re
+
+# Builds the LLM prompt within a token budget. The data summary of wide datasets and the conversation (with code
+# and print output) can make prompts very large, which makes every call slow and expensive. So the columns are ranked
+# by how well they match the question: the most relevant ones get their full description, the others a one line
+# description, so the schema is never lost. Conversation messages are truncated, the most recent ones are kept first.
+
+try:
+    import tiktoken
+except ImportError: # then tokens are estimated from the text length
+    tiktoken = None
+
+CHARS_PER_TOKEN = 4 # estimate without tiktoken
+STOP_WORDS = {'the', 'a', 'an', 'and', 'or', 'of', 'in', 'on', 'to', 'for', 'with', 'by', 'is', 'are', 'be', 'that',
+              'this', 'all', 'only', 'show', 'me', 'give', 'find', 'which', 'what', 'from', 'where', 'than', 'per',
+              'rows', 'data', 'it', 'as', 'at', 'how', 'many', 'much', 'i', 'want', 'please', 'can', 'you', 'now'}
+TRUNCATED = '... [truncated] ...'
+
+
+def _encoding(model):
+    """The tiktoken encoding of the model, or None if it can't be loaded (e.g. offline, its file is downloaded on first use)"""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError: # unknown model
+            return tiktoken.get_encoding('cl100k_base')
+    except Exception as e:
+        print(f"Could not load the tokenizer, token counts are estimated: {e}")
+        return None
+
+
+def words(text):
+    """Lower case words (split on non-alphanumerics and underscores), without stop words"""
+    return {w for w in re.split(r'[^0-9a-z]+', text.lower()) if len(w) > 1 and w not in STOP_WORDS}
+
+
+def split_columns(column_info):
+    """The column descriptions of summarize_csv as (column name, lines) per column"""
+    columns = []
+    for line in column_info:
+        match = re.match(r"Column: '(.*)'$", line)
+        if match:
+            columns.append((match.group(1), [line]))
+        elif columns and line:
+            columns[-1][1].append(line)
+    return columns
+
+
+def relevance(question, question_words, name, lines):
+    """Score of a column for a question: the column name itself counts most, then words of the name, then values"""
+    name_words = words(name)
+    value_words = words(' '.join(lines[1:]))
+    score = 10 if name.lower() in question.lower() else 0
+    score += 3 * len(question_words & name_words)
+    score += sum(2 for w in question_words - name_words if any(w in n or n in w for n in name_words if len(n) > 2))
+    score += len(question_words & value_words)
+    return score
+
+
+class PromptBuilder:
+    def __init__(self, max_tokens=6000, history_tokens=1500, model='gpt-4o'):
+        self.max_tokens = max_tokens # for the whole prompt
+        self.history_tokens = history_tokens # at most, for the conversation
+        self.encoding = _encoding(model) # None: tokens are estimated from the text length
+
+    def count_tokens(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return len(text) // CHARS_PER_TOKEN + 1
+
+    def truncate(self, text, max_tokens, keep='both'):
+        """Shorten text to about max_tokens, keeping its start, its end ('tail', e.g. for tracebacks) or both"""
+        if self.count_tokens(text) <= max_tokens:
+            return text
+        chars = max(0, max_tokens * len(text) // self.count_tokens(text) - len(TRUNCATED))
+        if keep == 'tail':
+            return TRUNCATED + text[-chars:]
+        if keep == 'head':
+            return text[:chars] + TRUNCATED
+        return text[:chars // 2] + TRUNCATED + text[-(chars - chars // 2):]
+
+    def summary(self, question, info, column_info, extra_info, max_tokens):
+        """The data summary for the question, within max_tokens if possible (every column is at least named)"""
+        header = '  \n'.join(info)
+        removed = ("The following colums have been removed:  \n\n" + '  \n'.join(extra_info)) if extra_info else ''
+        columns = split_columns(column_info)
+        question_words = words(question)
+        ranked = sorted(range(len(columns)), key=lambda i: -relevance(question, question_words, *columns[i])) # stable, so ties keep the file order
+        short = {i: f"Column: '{name}' ({lines[1].strip() if len(lines) > 1 else 'no details'})"
+                 for i, (name, lines) in enumerate(columns)}
+        used = self.count_tokens(header) + self.count_tokens(removed) + sum(self.count_tokens(line) for line in short.values())
+        full = set()
+        for i in ranked: # the full description replaces the short one, as long as it fits
+            extra = self.count_tokens('  \n'.join(columns[i][1])) - self.count_tokens(short[i])
+            if used + extra > max_tokens:
+                continue
+            full.add(i)
+            used += extra
+        lines = []
+        for i, (name, column_lines) in enumerate(columns):
+            lines.extend(column_lines + [''] if i in full else [short[i]])
+        if len(full) < len(columns):
+            lines.append("(Columns on a single line are summarized; their values were left out to keep the prompt short.)")
+        return '  \n'.join([header, '  \n'.join(lines)]) + removed
+
+    def conversation(self, messages, max_tokens):
+        """The preceding messages ((type, content) pairs, oldest first), most recent first within max_tokens"""
+        kept = []
+        remaining = max_tokens
+        per_message = max(50, max_tokens // max(1, len(messages)))
+        for kind, content in reversed(messages):
+            text = kind + ': ' + self.truncate(content, max(per_message, remaining // 2))
+            tokens = self.count_tokens(text)
+            if tokens > remaining:
+                break
+            kept.append(text)
+            remaining -= tokens
+        return '\n'.join(reversed(kept))
+
+    def build(self, template, question, info, column_info, extra_info, messages, **fields):
+        """template formatted with a budgeted data_summary and conversation, and the other fields as given"""
+        fixed = self.count_tokens(template.format(question=question, data_summary='', conversation='', **fields))
+        remaining = max(0, self.max_tokens - fixed)
+        conversation = self.conversation(messages, min(self.history_tokens, remaining // 3))
+        data_summary = self.summary(question, info, column_info, extra_info, remaining - self.count_tokens(conversation))
+        return template.format(question=question, data_summary=data_summary, conversation=conversation, **fields)
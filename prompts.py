@@ -0,0 +1,84 @@
+# Templates of the LLM calls, used by the app (and by the benchmarks, so they measure the real prompts).
+# Formatted with prompt_builder.PromptBuilder.build, which fits the data summary and conversation in a token budget.
+
+template = """
+You are an bot that writes python code to filter csv data, using pandas, and can answer questions about the dataset, including making plots.
+
+The dataset is provided in the following file: {filepath}
+Load it with {reader}('{filepath}'). Identifier columns (like product_id) are strings, and text columns with few distinct values are categoricals.
+
+Here is a summary of the data:
+
+<summary>
+{data_summary}
+</summary>
+{values}{state}
+Write code that performs the filtering requested by the user and writes the result to a new file. If any plots are generated, make sure these are also written to files. Do not show the plots.
+CRITICAL: Always wrap code in <code language="python">...</code> HTML tags. Never leave code untagged. 
+
+
+Preceeding conversation:
+{conversation}
+
+User query: {question}
+Explanation and code:"""
+
+
+sql_template = """
+You are an bot that writes SQL queries (DuckDB dialect) to filter data and answer questions about the dataset.
+
+The dataset ({filepath}) is loaded in the table: {table}
+
+Here is a summary of the data:
+
+<summary>
+{data_summary}
+</summary>
+{values}
+Write a single SELECT query per code block that returns the rows or aggregates requested by the user. The result table of each query is shown to the user.
+CRITICAL: Always wrap queries in <code language="sql">...</code> HTML tags. Never leave queries untagged. 
+
+
+Preceeding conversation:
+{conversation}
+
+User query: {question}
+Explanation and SQL:"""
+
+
+retry_template = """The code you wrote did not run correctly. Try again.
+
+User query: {question}
+
+Generated answer: {answer}
+
+Errors: {errors}
+
+"""
+
+insights_template = """
+
+Summary of the full dataset: 
+<summary>
+{original_summary}
+</summary>
+
+User query: {question}
+
+Generated answer: 
+{answer}
+
+Summary of resulting dataset: 
+<summary>
+{new_summary}
+</summary>
+
+Provide relevant insights about the filtered data
+"""
+
+
+def values_section(value_lines):
+    """The {values} part of the templates: values from the user query that were found in the data (see value_index)"""
+    if not value_lines:
+        return ''
+    return 'Values from the user query found in the data:  \n' + '  \n'.join(value_lines) + '\n'
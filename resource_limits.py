@@ -0,0 +1,109 @@
+import math
+import os
+import resource
+import signal
+import time
+
+# Limits for executing generated code, and accounting of what an execution used.
+# The limits are set as soft limits in the process that runs the code (a warm worker or a new python3 process),
+# and restored afterwards, so a warm worker can run the next job with fresh limits.
+# The accounting (peak RSS, CPU seconds, wall time, bytes read/written) ends up in result['resources'].
+
+MAX_OPEN_FILES = 256
+MAX_OUTPUT_MB = 1024 # size of a single written file
+LIMITS = {
+    'max_memory_mb': resource.RLIMIT_AS,
+    'max_cpu_seconds': resource.RLIMIT_CPU,
+    'max_open_files': resource.RLIMIT_NOFILE,
+    'max_output_mb': resource.RLIMIT_FSIZE,
+}
+
+
+class CPULimitExceeded(BaseException): # not an Exception, so generated code can't catch it by accident
+    pass
+
+
+def _raise_cpu_limit(signum, frame):
+    raise CPULimitExceeded('CPU time limit exceeded')
+
+
+def install_signal_handlers():
+    """Turn exceeded CPU and file size limits into errors instead of killing the process (main thread only)"""
+    signal.signal(signal.SIGXCPU, _raise_cpu_limit)
+    signal.signal(signal.SIGXFSZ, signal.SIG_IGN) # writes beyond the limit then fail with OSError (EFBIG)
+
+
+def _read_proc(name):
+    """Fields of /proc/self/<name> as a dict, empty if not available (e.g. not on Linux)"""
+    try:
+        with open(f'/proc/self/{name}') as f:
+            return dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return {}
+
+
+def virtual_memory_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def _soft_limit(resource_id, value):
+    _, hard = resource.getrlimit(resource_id)
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    resource.setrlimit(resource_id, (value, hard))
+
+
+def apply_limits(limits):
+    """
+    Sets the limits for the code that runs next in this process. Returns the previous limits, for restore_limits.
+    limits: dict with max_memory_mb (on top of the memory already in use), max_cpu_seconds (on top of the CPU time
+    already used), max_open_files and max_output_mb; missing or None values are not limited.
+    """
+    saved = {resource_id: resource.getrlimit(resource_id) for resource_id in LIMITS.values()}
+    if limits.get('max_memory_mb'):
+        _soft_limit(resource.RLIMIT_AS, virtual_memory_bytes() + limits['max_memory_mb'] * 1024**2)
+    if limits.get('max_cpu_seconds'):
+        _soft_limit(resource.RLIMIT_CPU, math.ceil(time.process_time() + limits['max_cpu_seconds']))
+    if limits.get('max_open_files'):
+        _soft_limit(resource.RLIMIT_NOFILE, limits['max_open_files'])
+    if limits.get('max_output_mb'):
+        _soft_limit(resource.RLIMIT_FSIZE, limits['max_output_mb'] * 1024**2)
+    return saved
+
+
+def restore_limits(saved):
+    for resource_id, value in saved.items():
+        resource.setrlimit(resource_id, value)
+
+
+def start_accounting():
+    """Snapshot at the start of an execution, for finish_accounting"""
+    try: # reset the peak RSS (VmHWM) of this process, so a warm worker reports the peak of this execution only
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+    io = _read_proc('io')
+    return {'wall': time.perf_counter(), 'cpu': time.process_time(),
+            'read': int(io.get('rchar', 0)), 'written': int(io.get('wchar', 0))}
+
+
+def finish_accounting(snapshot):
+    """Resources used since start_accounting, as a dict of numbers"""
+    status = _read_proc('status')
+    if 'VmHWM' in status:
+        peak_kb = int(status['VmHWM'].split()[0])
+    else: # peak over the whole lifetime of the process
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    io = _read_proc('io')
+    return {
+        'peak_rss_mb': round(peak_kb / 1024, 1),
+        'cpu_seconds': round(time.process_time() - snapshot['cpu'], 3),
+        'wall_seconds': round(time.perf_counter() - snapshot['wall'], 3),
+        'bytes_read': int(io.get('rchar', 0)) - snapshot['read'],
+        'bytes_written': int(io.get('wchar', 0)) - snapshot['written'],
+    }
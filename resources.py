@@ -0,0 +1,78 @@
+import json
+import os
+import threading
+
+# Resources that are shared by all sessions of the app process (the app wraps them in st.cache_resource):
+# the LLM client with a pooled HTTP connection, the catalog of available datasets and the stored descriptions.
+# They only do I/O when something has changed, instead of on every rerun.
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError: # without watchdog the catalog checks the directory mtime instead
+    Observer = None
+    FileSystemEventHandler = object
+
+
+def make_llm_client(api_key, model_name="gpt-4o", max_connections=20):
+    """ChatOpenAI client with an HTTP connection pool, so concurrent sessions reuse connections"""
+    import httpx
+    from langchain_openai import ChatOpenAI
+    limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    http_client = httpx.Client(limits=limits, timeout=httpx.Timeout(120, connect=10))
+    return ChatOpenAI(model_name=model_name, temperature=0, api_key=api_key, http_client=http_client)
+
+
+class _InvalidateOnChange(FileSystemEventHandler):
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def on_any_event(self, event):
+        self.catalog.invalidate()
+
+
+class DatasetCatalog:
+    """List of the files in a directory, refreshed when the directory changes"""
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.files = None
+        self.mtime = None
+        self.observer = None
+        if Observer is not None:
+            self.observer = Observer()
+            self.observer.schedule(_InvalidateOnChange(self), directory, recursive=False)
+            self.observer.daemon = True
+            self.observer.start()
+
+    def invalidate(self):
+        with self.lock:
+            self.files = None
+
+    def list(self):
+        with self.lock:
+            if self.observer is None: # no change notifications, so check the directory itself
+                mtime = os.stat(self.directory).st_mtime_ns
+                if mtime != self.mtime:
+                    self.files, self.mtime = None, mtime
+            if self.files is None:
+                self.files = sorted(os.path.join(self.directory, fn) for fn in os.listdir(self.directory))
+            return list(self.files)
+
+
+class DescriptionStore:
+    """The stored dataset descriptions, reloaded only when the file changes"""
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.mtime = None
+
+    def get(self, dataset):
+        with self.lock:
+            mtime = os.path.getmtime(self.path)
+            if mtime != self.mtime:
+                with open(self.path, 'r') as f:
+                    self.descriptions = json.load(f)
+                self.mtime = mtime
+            return self.descriptions.get(dataset)
@@ -0,0 +1,71 @@
+import math
+import os
+import re
+from disk_cache import DiskCache, make_key
+
+# Cache of LLM answers whose code ran without errors. Keyed by the dataset fingerprint, the data summary,
+# the (normalized) question and the conversation window, so a cache hit can skip the LLM call and the retry loop.
+# Optionally, questions that are phrased differently but mean the same are found with embeddings.
+
+RESPONSE_CACHE_DIR = os.path.join('cache', 'responses')
+RESPONSE_CACHE_MAX_BYTES = 200 * 1024**2
+RESPONSE_CACHE_TTL = 7 * 24 * 3600
+MAX_SIMILAR_QUESTIONS = 500 # per context (dataset + summary + conversation)
+
+
+def normalize_text(text):
+    """Lower case, collapsed whitespace and without trailing punctuation, so trivial differences don't cause cache misses"""
+    return re.sub(r'\s+', ' ', text.lower()).strip().rstrip('?.!').strip()
+
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class ResponseCache:
+    def __init__(self, cache_dir=RESPONSE_CACHE_DIR, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL,
+                 embed=None, similarity_threshold=0.97):
+        self.cache = DiskCache(cache_dir, max_bytes=max_bytes, ttl=ttl)
+        self.embed = embed # optional function text -> vector, for near-duplicate questions
+        self.similarity_threshold = similarity_threshold
+
+    def context_key(self, dataset_fingerprint, data_summary, conversation, variant):
+        """variant: anything else that changes the answer, e.g. the engine (and thus the prompt template)"""
+        return make_key('context', dataset_fingerprint, normalize_text(data_summary), normalize_text(conversation), variant)
+
+    def lookup(self, context_key, question):
+        """Returns (answer, key) for the question in this context, or (None, None)"""
+        key = make_key(context_key, normalize_text(question))
+        value, _ = self.cache.get(key)
+        if value:
+            return value['answer'], key
+        if self.embed is None:
+            return None, None
+        index, _ = self.cache.get(make_key('similar', context_key))
+        if not index:
+            return None, None
+        embedding = self.embed(question)
+        best = max(index, key=lambda item: cosine_similarity(embedding, item['embedding']))
+        if cosine_similarity(embedding, best['embedding']) >= self.similarity_threshold:
+            value, _ = self.cache.get(best['key'])
+            if value:
+                print(f"Similar question in cache: {best['question']}")
+                return value['answer'], best['key']
+        return None, None
+
+    def store(self, context_key, question, answer):
+        """Store an answer whose code was verified to run"""
+        key = make_key(context_key, normalize_text(question))
+        self.cache.put(key, {'question': question, 'answer': answer})
+        if self.embed is not None:
+            index_key = make_key('similar', context_key)
+            index, _ = self.cache.get(index_key)
+            index = [item for item in (index or []) if item['key'] != key][-(MAX_SIMILAR_QUESTIONS - 1):]
+            index.append({'question': question, 'key': key, 'embedding': self.embed(question)})
+            self.cache.put(index_key, index)
+
+    def invalidate(self, key):
+        """Remove an answer, e.g. when its code no longer runs"""
+        self.cache.delete(key)
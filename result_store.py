@@ -0,0 +1,73 @@
+import os
+import threading
+from collections import OrderedDict
+from summarize_csv import load_working_file
+
+# The chat history only keeps small handles to result files (path, size, schema and a preview).
+# The data frames themselves are loaded when a message is displayed, through a cache that is bounded in memory,
+# with a separate budget per session, so long sessions don't keep every result in memory.
+
+CACHE_MAX_BYTES = 2 * 1024**3 # for all sessions together
+SESSION_MAX_BYTES = 500 * 1024**2
+PREVIEW_ROWS = 5
+
+
+class ResultChanged(Exception):
+    """The file of a handle was overwritten after the handle was made (e.g. by a later result with the same name)"""
+
+
+def make_handle(path, df):
+    """Compact description of a result file, stored on the message instead of the data frame"""
+    return {
+        'path': path,
+        'rows': len(df),
+        'columns': {str(column): str(dtype) for column, dtype in df.dtypes.items()},
+        'preview': df.head(PREVIEW_ROWS).to_dict(orient='records'),
+        'mtime': os.path.getmtime(path),
+    }
+
+
+class FrameCache:
+    """LRU cache of loaded data frames, bounded in bytes, both in total and per session"""
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, session_max_bytes=SESSION_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.session_max_bytes = session_max_bytes
+        self.frames = OrderedDict() # (session, path, mtime) -> (df, size)
+        self.lock = threading.Lock()
+
+    def _evict(self, session):
+        total = sum(size for _, size in self.frames.values())
+        session_total = sum(size for key, (_, size) in self.frames.items() if key[0] == session)
+        for key in list(self.frames):
+            if total <= self.max_bytes and session_total <= self.session_max_bytes:
+                break
+            if total > self.max_bytes or key[0] == session:
+                _, size = self.frames.pop(key)
+                total -= size
+                if key[0] == session:
+                    session_total -= size
+
+    def put(self, session, path, df, mtime=None):
+        key = (session, path, mtime or os.path.getmtime(path))
+        size = int(df.memory_usage(deep=True).sum())
+        with self.lock:
+            self.frames[key] = (df, size)
+            self.frames.move_to_end(key)
+            self._evict(session)
+
+    def load(self, session, handle):
+        """
+        The data frame of a handle, from the cache or reloaded from its file.
+        Raises ResultChanged if the file is not the one of the handle anymore, and OSError if it is gone.
+        """
+        key = (session, handle['path'], handle['mtime'])
+        with self.lock:
+            if key in self.frames:
+                self.frames.move_to_end(key)
+                return self.frames[key][0]
+        if os.path.getmtime(handle['path']) != handle['mtime']:
+            raise ResultChanged(handle['path'])
+        df = load_working_file(handle['path'])
+        self.put(session, handle['path'], df, handle['mtime'])
+        return df
+
@@ -0,0 +1,81 @@
+import os
+import tempfile
+from disk_cache import DiskCache, file_fingerprint, make_key
+
+# The working dataset of a session is converted once to an uncompressed Arrow (Feather v2) file.
+# Executor workers memory-map that file, so the data is loaded once per worker instead of parsing the csv for
+# every code block, and the pages of the file are shared between the workers by the OS.
+
+ARROW_CACHE_DIR = os.path.join('cache', 'arrow')
+ARROW_CACHE_MAX_BYTES = 20 * 1024**3
+ARROW_FILE = 'data.arrow'
+
+_frames = {} # loaded frames in a worker process, arrow path -> DataFrame
+MAX_LOADED_FRAMES = 2
+
+
+def prepare_shared_dataset(data_path, cache_dir=ARROW_CACHE_DIR):
+    """Returns the path of the Arrow copy of data_path, creating it if the file is new or has changed"""
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    cache = DiskCache(cache_dir, max_bytes=ARROW_CACHE_MAX_BYTES)
+    key = make_key(os.path.abspath(data_path), file_fingerprint(data_path))
+    cached, entry_dir = cache.get(key)
+    if cached is None:
+        if data_path.endswith('.parquet'):
+            table = pq.read_table(data_path) # keeps the pandas metadata, e.g. categoricals
+        else:
+            # read with pandas (not the arrow csv reader), so the dtypes are exactly what pd.read_csv gives the generated code
+            table = pa.Table.from_pandas(pd.read_csv(data_path), preserve_index=False)
+        with tempfile.TemporaryDirectory() as tmp:
+            arrow_path = os.path.join(tmp, ARROW_FILE)
+            feather.write_feather(table, arrow_path, compression='uncompressed')
+            entry_dir = cache.put(key, {'source': data_path, 'rows': table.num_rows}, files={ARROW_FILE: arrow_path})
+    return os.path.join(entry_dir, ARROW_FILE)
+
+
+def load_shared_frame(arrow_path):
+    """Memory-maps the Arrow file and converts it to a DataFrame, once per worker process"""
+    if arrow_path not in _frames:
+        import pyarrow as pa
+        with pa.memory_map(arrow_path, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        if len(_frames) >= MAX_LOADED_FRAMES:
+            _frames.pop(next(iter(_frames)))
+        # split_blocks avoids consolidating columns, so numeric columns can stay views on the mapped pages
+        _frames[arrow_path] = table.to_pandas(split_blocks=True)
+    # shallow copy: with copy-on-write, changes made by the generated code don't leak into the cached frame
+    return _frames[arrow_path].copy(deep=False)
+
+
+def intercept_readers(pd, file_name, arrow_path):
+    """
+    Replaces pd.read_csv and pd.read_parquet by versions that return the preloaded frame when the working file is read
+    without special options. Returns the original functions, so they can be restored with restore_readers.
+    """
+    originals = {'read_csv': pd.read_csv, 'read_parquet': pd.read_parquet}
+
+    def is_working_file(path):
+        return isinstance(path, (str, os.PathLike)) and os.path.basename(os.fspath(path)) == file_name
+
+    def read_csv(filepath_or_buffer, *args, **kwargs):
+        if not args and set(kwargs) <= {'low_memory', 'encoding'} and is_working_file(filepath_or_buffer):
+            return load_shared_frame(arrow_path)
+        return originals['read_csv'](filepath_or_buffer, *args, **kwargs)
+
+    def read_parquet(path, *args, columns=None, **kwargs):
+        if not args and set(kwargs) <= {'engine'} and is_working_file(path):
+            df = load_shared_frame(arrow_path)
+            return df[list(columns)] if columns is not None else df
+        return originals['read_parquet'](path, *args, columns=columns, **kwargs)
+
+    pd.read_csv = read_csv
+    pd.read_parquet = read_parquet
+    return originals
+
+
+def restore_readers(pd, originals):
+    for name, function in originals.items():
+        setattr(pd, name, function)
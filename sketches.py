@@ -0,0 +1,128 @@
+import numpy as np
+import pandas as pd
+
+# Small streaming data sketches used for profiling csv files that do not fit in memory.
+
+
+def hash_values(values):
+    """64 bit hashes for an array/Series of values. Values are hashed as strings, so the hashes don't depend on chunk dtypes"""
+    return pd.util.hash_array(np.asarray(pd.Series(values).astype(str), dtype=object))
+
+
+class HyperLogLog:
+    """Estimates the number of distinct values in a stream with a fixed amount of memory (2**precision bytes)"""
+    def __init__(self, precision=14):
+        self.p = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if len(hashes) == 0:
+            return
+        idx = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes << np.uint64(self.p) # remaining bits, moved to the top
+        rank = np.full(len(hashes), 64 - self.p + 1, dtype=np.uint8)
+        nonzero = rest != 0
+        # position of the first 1 bit = number of leading zeros + 1
+        rank[nonzero] = (64 - np.floor(np.log2(rest[nonzero].astype(np.float64)))).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def add(self, values):
+        self.add_hashes(hash_values(values))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m**2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * self.m and zeros > 0: # small range correction (linear counting)
+            estimate = self.m * np.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class DistinctCounter:
+    """Keeps the exact set of distinct values until it grows beyond exact_limit, then switches to a HyperLogLog estimate"""
+    def __init__(self, exact_limit=10000, precision=14):
+        self.exact_limit = exact_limit
+        self.precision = precision
+        self.values = set()
+        self.hll = None
+
+    @property
+    def exact(self):
+        return self.hll is None
+
+    def add(self, values):
+        if self.exact:
+            self.values.update(pd.unique(np.asarray(values)).tolist())
+            if len(self.values) > self.exact_limit:
+                self.hll = HyperLogLog(self.precision)
+                self.hll.add(list(self.values))
+                self.values = set()
+        else:
+            self.hll.add(values)
+
+    def count(self):
+        return len(self.values) if self.exact else self.hll.count()
+
+
+class TopK:
+    """
+    Mergeable heavy hitters summary: the counts per chunk are added to the running counts, and when there are more
+    than `capacity` counters, only the largest are kept. Once counters have been dropped, the counts are estimates:
+    a value can have been dropped (and counted again from zero) earlier, so its count can be too low, by at most
+    `error` (the sum of the largest dropped count of every pruning). While error is 0, the counts are exact.
+    """
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    @property
+    def exact(self):
+        return self.error == 0
+
+    def add(self, values):
+        for value, count in pd.Series(values).value_counts().items():
+            self.counts[value] = self.counts.get(value, 0) + int(count)
+        if len(self.counts) > self.capacity:
+            ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+            self.error += ranked[self.capacity][1]
+            self.counts = dict(ranked[:self.capacity])
+
+    def most_common(self, n):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class RowDuplicateCounter:
+    """Counts duplicate rows from row hashes: exact up to exact_limit distinct rows, estimated with HyperLogLog after that"""
+    def __init__(self, exact_limit=1000000, precision=16):
+        self.exact_limit = exact_limit
+        self.precision = precision
+        self.rows = 0
+        self.hashes = set()
+        self.hll = None
+
+    @property
+    def exact(self):
+        return self.hll is None
+
+    def add(self, df):
+        # hash the string representation, so dtype differences between chunks don't matter
+        hashes = pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy()
+        self.rows += len(hashes)
+        if self.exact:
+            self.hashes.update(hashes.tolist())
+            if len(self.hashes) > self.exact_limit:
+                self.hll = HyperLogLog(self.precision)
+                self.hll.add_hashes(np.fromiter(self.hashes, dtype=np.uint64, count=len(self.hashes)))
+                self.hashes = set()
+        else:
+            self.hll.add_hashes(hashes)
+
+    def count(self):
+        distinct = len(self.hashes) if self.exact else self.hll.count()
+        return max(self.rows - distinct, 0)
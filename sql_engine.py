@@ -0,0 +1,179 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from disk_cache import file_fingerprint, make_key
+from tracing import span
+
+try:
+    import duckdb
+except ImportError: # the SQL engine is not available, the app falls back to pandas code generation
+    duckdb = None
+
+# Alternative to SafeCodeExecutorWithInputs: the dataset is ingested once into an embedded DuckDB database,
+# and the LLM writes SQL queries, which run in-process (vectorized, multi-threaded, and spilling to disk if needed).
+# The results are written to csv files, so the app can display them in the same way as the results of generated code.
+
+DATABASE_DIR = os.path.join('cache', 'duckdb')
+DATABASE_MAX_BYTES = 20 * 1024**3 # least recently used databases are removed beyond this
+TABLE_NAME = 'data'
+
+
+def sql_available():
+    return duckdb is not None
+
+
+class DuckDBExecutor:
+    def __init__(self, input_directory, working_file, timeout=100, max_memory_mb=2000, threads=None, database_dir=DATABASE_DIR,
+                 database_max_bytes=DATABASE_MAX_BYTES):
+        self.input_directory = input_directory
+        self.working_file = working_file
+        self.timeout = timeout
+        self.max_memory_mb = max_memory_mb # DuckDB spills to disk beyond this
+        self.threads = threads or os.cpu_count() or 1
+        self.database_dir = database_dir
+        self.database_max_bytes = database_max_bytes
+        self.temp_dir = None
+        self.cancel_event = None
+
+    def extract_code_blocks(self, text):
+        """Extract SQL blocks from text"""
+        matches = re.findall(r'<code language="sql">(.*?)</code>', text, re.DOTALL)
+        if not matches:
+            matches = re.findall(r'```sql(.*?)```', text, re.DOTALL)
+        return [query.strip().rstrip(';').strip() for query in matches]
+
+    def database_path(self):
+        """
+        Database for the working file, ingested on first use (and again when the file changes).
+        Databases are named <file key>-<content key>.duckdb, so older versions of the same file can be removed.
+        """
+        data_path = os.path.join(self.input_directory, self.working_file)
+        file_key = make_key(os.path.abspath(data_path))[:16]
+        db_path = os.path.join(self.database_dir, f'{file_key}-{make_key(file_fingerprint(data_path))}.duckdb')
+        if os.path.exists(db_path):
+            os.utime(db_path) # mark as recently used
+        else:
+            os.makedirs(self.database_dir, exist_ok=True)
+            tmp_path = db_path + f'.tmp{os.getpid()}-{threading.get_ident()}'
+            reader = 'read_parquet' if data_path.endswith('.parquet') else 'read_csv_auto'
+            with duckdb.connect(tmp_path) as conn:
+                conn.execute(f"CREATE TABLE {TABLE_NAME} AS SELECT * FROM {reader}(?)", [os.path.abspath(data_path)])
+            os.replace(tmp_path, db_path)
+            print(f"🦆 Ingested {self.working_file} into {db_path}")
+            self.prune_databases(file_key, db_path)
+        return db_path
+
+    def prune_databases(self, file_key, keep):
+        """
+        Remove the databases of older versions of the file, and the least recently used databases beyond
+        database_max_bytes. Open connections to a removed database keep working (the file is only unlinked).
+        """
+        databases = []
+        for name in os.listdir(self.database_dir):
+            path = os.path.join(self.database_dir, name)
+            if not name.endswith('.duckdb') or path == keep:
+                continue
+            try:
+                if name.startswith(file_key + '-'):
+                    os.unlink(path)
+                else:
+                    databases.append((os.path.getmtime(path), os.path.getsize(path), path))
+            except OSError: # removed by another process
+                pass
+        total = os.path.getsize(keep) + sum(size for _, size, _ in databases)
+        for _, size, path in sorted(databases): # oldest first
+            if total <= self.database_max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def connect(self):
+        conn = duckdb.connect(self.database_path(), read_only=True)
+        conn.execute(f"SET threads TO {int(self.threads)}")
+        conn.execute(f"SET memory_limit = '{int(self.max_memory_mb)}MB'")
+        conn.execute("SET temp_directory = ?", [os.path.abspath(os.path.join(self.database_dir, 'spill'))])
+        conn.execute("SET enable_external_access = false") # queries can't read or write other files
+        conn.execute("SET lock_configuration = true")
+        return conn
+
+    def validate_query(self, query):
+        """Only single read-only queries are allowed"""
+        try:
+            statements = duckdb.extract_statements(query)
+        except duckdb.Error as e:
+            return False, f"Syntax error: {e}"
+        if len(statements) != 1:
+            return False, "Exactly one SQL statement per code block is allowed"
+        if statements[0].type != duckdb.StatementType.SELECT:
+            return False, f"Only SELECT queries are allowed, not {statements[0].type.name}"
+        return True, None
+
+    def execute_query(self, conn, query, output_file):
+        """Run one query, with a timeout, and write the result table to output_file in the temp dir"""
+        finished = threading.Event()
+        threading.Thread(target=self._interrupt_when_needed, args=(conn, finished), daemon=True).start()
+        try:
+            df = conn.execute(query).df()
+        except duckdb.InterruptException:
+            if self.cancel_event is not None and self.cancel_event.is_set():
+                return {'success': False, 'stdout': '', 'stderr': 'Query was cancelled', 'output_files': []}
+            return {'success': False, 'stdout': '', 'stderr': f'Query timed out after {self.timeout} seconds', 'output_files': []}
+        except duckdb.Error as e:
+            return {'success': False, 'stdout': '', 'stderr': f'SQL error: {e}', 'output_files': []}
+        finally:
+            finished.set()
+        df.to_csv(os.path.join(self.temp_dir, output_file), index=False)
+        return {'success': True, 'stdout': f'Query returned {len(df)} rows', 'stderr': '', 'output_files': [output_file]}
+
+    def _interrupt_when_needed(self, conn, finished):
+        """Interrupts the running query on timeout or cancellation"""
+        deadline = time.monotonic() + self.timeout
+        while not finished.wait(0.2):
+            cancelled = self.cancel_event is not None and self.cancel_event.is_set()
+            if cancelled or time.monotonic() > deadline:
+                conn.interrupt()
+                return
+
+    def execute_safe(self, llm_response, skip_blocks=0, cancel_event=None, previous_results=None):
+        """
+        Same interface as SafeCodeExecutorWithInputs.execute_safe, for SQL queries in the LLM response
+        (queries only read the table, so previous_results are not needed)
+        """
+        self.cancel_event = cancel_event
+        results = []
+        queries = self.extract_code_blocks(llm_response)[skip_blocks:]
+        if not queries:
+            return []
+        self.temp_dir = tempfile.mkdtemp(prefix="sql_exec_")
+        prefix = os.path.splitext(self.working_file)[0].replace('_informative', '')
+        try:
+            conn = self.connect()
+        except Exception as e:
+            return [{'block_index': i, 'success': False, 'stdout': '', 'stderr': f'Database error: {e}', 'output_files': []}
+                    for i in range(skip_blocks, skip_blocks + len(queries))]
+        with conn:
+            for i, query in enumerate(queries, start=skip_blocks):
+                print(f"\n--- Executing SQL Block {i+1} ---\n{query}\n")
+                is_valid, error = self.validate_query(query)
+                if not is_valid:
+                    results.append({'block_index': i, 'success': False, 'error': error, 'stdout': '', 'stderr': error, 'output_files': []})
+                    continue
+                output_file = f"{prefix}_query_{make_key(query)[:8]}.csv"
+                with span('sql_query', index=i) as s:
+                    result = self.execute_query(conn, query, output_file)
+                    s.set(success=result['success'])
+                result['block_index'] = i
+                result['temp_dir'] = self.temp_dir
+                results.append(result)
+                print("✅ Success!" if result['success'] else f"❌ Failed!\nError: {result['stderr']}")
+        return results
+
+    def cleanup(self):
+        if self.temp_dir and os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
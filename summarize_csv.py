@@ -1,21 +1,240 @@
 import pandas as pd
 import numpy as np
 from collections import Counter
+try:
+    import pyarrow as pa
+except ImportError: # columns are sent to worker processes as NumPy arrays instead
+    pa = None
 import os
+import re
+import shutil
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from disk_cache import DiskCache, file_fingerprint, make_key
+from sketches import DistinctCounter, TopK, RowDuplicateCounter
+from tracing import span
+from value_index import ValueIndex, INDEX_MAX_UNIQUE, index_file_name
 
-def summarize_csv(file_path, data_dir, max_unique_values=20, sample_size=5):
+SUMMARY_CACHE_DIR = os.path.join('cache', 'summaries')
+SUMMARY_CACHE_MAX_BYTES = 10 * 1024**3
+STREAMING_MIN_FILE_BYTES = 1024**3
+STREAMING_CHUNKSIZE = 100000
+PARALLEL_MIN_COLUMNS = 32
+PARALLEL_MIN_CELLS = 5000000
+ID_COLUMN_PATTERN = re.compile(r'(^|_)id$', re.IGNORECASE) # identifiers are kept as strings, e.g. 'product_id'
+CATEGORY_MAX_FRACTION = 0.5 # text columns with fewer unique values than this fraction of the rows are stored as categoricals
+
+
+def summarize_csv(file_path, data_dir, max_unique_values=20, sample_size=5, use_cache=True, cache_dir=SUMMARY_CACHE_DIR,
+                  streaming=None, chunksize=STREAMING_CHUNKSIZE, workers=None, output_format='parquet'):
     """
     Reads a CSV file and provides a comprehensive summary of its structure and content.
+    Results (and the informative csv file) are cached on disk, keyed by a fingerprint of the file content and the parameters,
+    so only new or changed files get profiled again.
+    An index of the values of the text columns (see value_index) is written next to the informative file.
     
     Parameters:
     file_path (str): Path to the CSV file
+    data_dir (str): Directory where the informative csv file is written
     max_unique_values (int): Maximum number of unique values to display for categorical columns
     sample_size (int): Number of example values to show for non-categorical columns
+    use_cache (bool): Whether to look up and store the result in the summary cache
+    cache_dir (str): Location of the summary cache
+    streaming (bool): Read the file in chunks with bounded memory. By default this is done for files larger than STREAMING_MIN_FILE_BYTES
+    chunksize (int): Number of rows per chunk in streaming mode
+    workers (int): Number of processes for profiling the columns (in-memory mode). By default this is decided from the table size
+    output_format (str): Format of the informative file: 'parquet' (columnar, with proper dtypes) or 'csv'
+    """
+    if streaming is None:
+        streaming = os.path.exists(file_path) and os.path.getsize(file_path) > STREAMING_MIN_FILE_BYTES
+    if streaming:
+        profile = lambda: _summarize_csv_streaming(file_path, data_dir, max_unique_values, sample_size, chunksize, output_format)
+    else:
+        profile = lambda: _summarize_csv(file_path, data_dir, max_unique_values, sample_size, workers, output_format)
+    with span('summary', streaming=streaming, file_bytes=os.path.getsize(file_path) if os.path.exists(file_path) else None) as s:
+        if not use_cache:
+            return profile()
+        try:
+            key = make_key(os.path.abspath(file_path), file_fingerprint(file_path), max_unique_values, sample_size, streaming, output_format)
+        except OSError:
+            return profile() # reports the error
+        cache = DiskCache(cache_dir, max_bytes=SUMMARY_CACHE_MAX_BYTES)
+        cached, entry_dir = cache.get(key)
+        if cached and 'index_file' in cached: # entries from before the value index are profiled again
+            output_file = cached['output_file']
+            for name in [output_file, cached['index_file']]:
+                output_path = os.path.join(data_dir, name)
+                cached_path = os.path.join(entry_dir, name)
+                if not os.path.exists(output_path) or os.path.getsize(output_path) != os.path.getsize(cached_path):
+                    write_replacing(output_path, lambda path: shutil.copy2(cached_path, path))
+            print(f"Using cached summary for: {file_path}")
+            s.set(cached=True)
+            return cached['info'], cached['column_info'], cached['extra_info'], output_file
+        s.set(cached=False)
+        result = profile()
+        if result:
+            info, column_info, extra_info, output_file = result
+            index_file = index_file_name(output_file)
+            value = {'info': info, 'column_info': column_info, 'extra_info': extra_info, 'output_file': output_file,
+                     'index_file': index_file}
+            cache.put(key, value, files={name: os.path.join(data_dir, name) for name in [output_file, index_file]})
+        return result
+
+
+def write_replacing(output_path, write):
+    """
+    Write a file of the data directory as a new file that then replaces the old one (write is called with its path).
+    Files in the data directory are never written in place: they are read-only and hard linked into the executions
+    of generated code (see code_exec).
     """
+    temp_path = f'{output_path}.tmp{os.getpid()}-{threading.get_ident()}'
+    try:
+        write(temp_path)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def analyze_column(series, max_unique_values, sample_size):
+    """
+    Profiles a single column. Returns the number of unique values, the first unique value,
+    and the summary lines for the column (only filled in for informative columns, with more than one value).
+    """
+    column = series.name
+    column_info = []
+    # Get unique values
+    unique_values = series.dropna().unique()
+    unique_count = len(unique_values)
+    #print(f"   Unique values: {unique_count}")
+    if unique_count <= 1:
+        return unique_count, unique_values.tolist()[0] if unique_count else None, column_info
+
+    column_info.append(f"Column: '{column}'")
+    column_info.append(f"   Unique values: {unique_count}")
+    # Count non-null values
+    non_null_count = series.count()
+    null_count = len(series) - non_null_count
+    #print(f"   Non-null values: {non_null_count}")
+    if null_count > 0:
+        column_info.append(f"   Null values: {null_count}")
     
+    # Determine if it's categorical or continuous
+    if unique_count <= max_unique_values and unique_count > 0:
+        # Limited set of values - show all
+        column_info.append(f"   All values: {sorted(unique_values.tolist())}")
+    else:
+        # Many values - show examples and statistics
+        if series.dtype in ['int64', 'float64']:
+            # Numeric column
+            column_info.append(f"   Min: {series.min()}")
+            column_info.append(f"   Max: {series.max()}")
+            column_info.append(f"   Mean: {series.mean():.2f}")
+            column_info.append(f"   Examples: {series.dropna().head(sample_size).tolist()}")
+        else:
+            # Text/object column
+            print(f"   Examples: {series.dropna().head(sample_size).tolist()}")
+            column_info.append(f"   Examples: {series.dropna().head(sample_size).tolist()}")
+            
+            # Show most common values if it's categorical-like
+            if unique_count < len(series) * 0.8:  # If less than 80% are unique
+                most_common = Counter(series.dropna()).most_common(5)
+                column_info.append(f"   Most common: {most_common}")
+    
+    column_info.append('')
+    return unique_count, unique_values.tolist()[0], column_info
+
+
+def _to_buffer(series):
+    """Column data in a form that is cheap to send to another process: Arrow arrays for text, NumPy arrays otherwise"""
+    if pa is not None and series.dtype not in ['int64', 'float64', 'bool']:
+        try:
+            return series.name, pa.array(series, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError): # mixed types
+            pass
+    return series.name, series.to_numpy()
+
+
+def _analyze_buffers(buffers, max_unique_values, sample_size):
+    """Runs in a worker process: rebuilds the columns from their buffers and profiles them"""
+    results = []
+    for name, values in buffers:
+        series = values.to_pandas() if pa is not None and isinstance(values, pa.Array) else pd.Series(values)
+        series.name = name
+        results.append(analyze_column(series, max_unique_values, sample_size))
+    return results
+
+
+def default_workers(n_rows, n_columns):
+    """Heuristic for the number of worker processes: starting processes and shipping the data only pays off for big, wide tables"""
+    if n_columns < PARALLEL_MIN_COLUMNS or n_rows * n_columns < PARALLEL_MIN_CELLS:
+        return 1
+    return max(1, min(os.cpu_count() or 1, n_columns // PARALLEL_MIN_COLUMNS * 2))
+
+
+def analyze_columns(df, max_unique_values, sample_size, workers=None):
+    """Profiles all columns of df, in a process pool if that is worthwhile. Results are returned in column order."""
+    if workers is None:
+        workers = default_workers(len(df), len(df.columns))
+    if workers <= 1:
+        return [analyze_column(df[column], max_unique_values, sample_size) for column in df.columns]
+    # a few batches of columns per worker, so uneven columns still get balanced
+    n_batches = min(len(df.columns), workers * 4)
+    batches = [list(range(i, len(df.columns), n_batches)) for i in range(n_batches)]
+    results = [None] * len(df.columns)
+    context = multiprocessing.get_context('forkserver') # don't fork the (multi-threaded) app process
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {}
+        for batch in batches:
+            buffers = [_to_buffer(df.iloc[:, i]) for i in batch]
+            futures[pool.submit(_analyze_buffers, buffers, max_unique_values, sample_size)] = batch
+        for future, batch in futures.items():
+            for i, result in zip(batch, future.result()):
+                results[i] = result
+    return results
+
+
+def informative_file_name(file_path, output_format='csv'):
+    """Name of the file with only the informative columns, which is written to the data directory"""
+    output_file = os.path.basename(file_path).replace('.csv', '_informative.' + output_format)
+    return output_file.replace(' ', '_')
+
+
+def identifier_dtypes(file_path):
+    """dtype argument for pd.read_csv that keeps identifier columns as strings, instead of turning them into numbers"""
+    columns = pd.read_csv(file_path, nrows=0).columns
+    return {column: str for column in columns if ID_COLUMN_PATTERN.search(str(column))}
+
+
+def load_working_file(path, **kwargs):
+    """Reads a working file (or result file), in whatever format it was written"""
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, **kwargs)
+    return pd.read_csv(path, **kwargs)
+
+
+def file_reader(path):
+    """Name of the pandas function that reads the file, for telling the LLM how to load it"""
+    return 'pd.read_parquet' if path.endswith('.parquet') else 'pd.read_csv'
+
+
+def parquet_compatible(df):
+    """
+    Text columns with mixed types (e.g. numbers and strings, which pd.read_csv can give for large files before pandas 3)
+    can't be written to parquet; they are converted to strings, as in the streaming mode
+    """
+    for column in df.columns:
+        if df[column].dtype == object and pd.api.types.infer_dtype(df[column], skipna=True).startswith('mixed'):
+            df[column] = df[column].astype('string')
+    return df
+
+
+def _summarize_csv(file_path, data_dir, max_unique_values, sample_size, workers=None, output_format='csv'):
+    """Does the actual profiling of the csv file, see summarize_csv"""
     try:
         # Read the CSV file
-        df = pd.read_csv(file_path)
+        df = pd.read_csv(file_path, dtype=identifier_dtypes(file_path))
         info = []
         info.append(f"CSV File Summary: {file_path}")
         info.append("=" * 50)
@@ -28,52 +247,21 @@ def summarize_csv(file_path, data_dir, max_unique_values=20, sample_size=5):
         no_values = []
         one_value = []
         informative_columns = []
+        categorical_columns = []
+        value_index = ValueIndex()
        
-        for column in df.columns:
-            
-            # Get unique values
-            unique_values = df[column].dropna().unique()
-            unique_count = len(unique_values)
-            #print(f"   Unique values: {unique_count}")
-
+        for column, (unique_count, first_value, lines) in zip(df.columns, analyze_columns(df, max_unique_values, sample_size, workers)):
             if unique_count == 0:
                 no_values.append(column)
             elif unique_count == 1:
-                one_value.append((column, unique_values.tolist()[0]))
+                one_value.append((column, first_value))
             else:
                 informative_columns.append(column)
-                column_info.append(f"Column: '{column}'")
-                column_info.append(f"   Unique values: {unique_count}")
-                # Count non-null values
-                non_null_count = df[column].count()
-                null_count = len(df) - non_null_count
-                #print(f"   Non-null values: {non_null_count}")
-                if null_count > 0:
-                    column_info.append(f"   Null values: {null_count}")
-                
-                # Determine if it's categorical or continuous
-                if unique_count <= max_unique_values and unique_count > 0:
-                    # Limited set of values - show all
-                    column_info.append(f"   All values: {sorted(unique_values.tolist())}")
-                else:
-                    # Many values - show examples and statistics
-                    if df[column].dtype in ['int64', 'float64']:
-                        # Numeric column
-                        column_info.append(f"   Min: {df[column].min()}")
-                        column_info.append(f"   Max: {df[column].max()}")
-                        column_info.append(f"   Mean: {df[column].mean():.2f}")
-                        column_info.append(f"   Examples: {df[column].dropna().head(sample_size).tolist()}")
-                    else:
-                        # Text/object column
-                        print(f"   Examples: {df[column].dropna().head(sample_size).tolist()}")
-                        column_info.append(f"   Examples: {df[column].dropna().head(sample_size).tolist()}")
-                        
-                        # Show most common values if it's categorical-like
-                        if unique_count < len(df) * 0.8:  # If less than 80% are unique
-                            most_common = Counter(df[column].dropna()).most_common(5)
-                            column_info.append(f"   Most common: {most_common}")
-                
-                column_info.append('')
+                column_info.extend(lines)
+                if pd.api.types.is_string_dtype(df[column]) and unique_count <= len(df) * CATEGORY_MAX_FRACTION:
+                    categorical_columns.append(column)
+                if pd.api.types.is_string_dtype(df[column]) and unique_count <= INDEX_MAX_UNIQUE:
+                    value_index.add_column(column, df[column].dropna().unique())
         
 
         extra_info = []
@@ -95,13 +283,19 @@ def summarize_csv(file_path, data_dir, max_unique_values=20, sample_size=5):
         info.append('')
         
         # Generate output filename if not provided
-        output_file = os.path.basename(file_path).replace('.csv', '_informative.csv')
-        output_file = output_file.replace(' ', '_')
+        output_file = informative_file_name(file_path, output_format)
         output_path = os.path.join(data_dir, output_file)
            
         
         # Save filtered dataframe
-        df_filtered.to_csv(output_path, index=False)
+        if output_format == 'parquet':
+            for column in categorical_columns: # dictionary encoded
+                df_filtered[column] = df_filtered[column].astype('category')
+            parquet_compatible(df_filtered)
+            write_replacing(output_path, lambda path: df_filtered.to_parquet(path, index=False))
+        else:
+            write_replacing(output_path, lambda path: df_filtered.to_csv(path, index=False))
+        value_index.save(os.path.join(data_dir, index_file_name(output_file)))
         print(f"\nFiltered dataset saved as: {output_file}")
         print(f"New dataset: {len(df_filtered)} rows, {len(df_filtered.columns)} columns")
 
@@ -114,6 +308,203 @@ def summarize_csv(file_path, data_dir, max_unique_values=20, sample_size=5):
     except Exception as e:
         print(f"Error reading file: {str(e)}")
 
+
+class ColumnProfile:
+    """Accumulates the statistics summarize_csv needs for one column, chunk by chunk"""
+    def __init__(self, sample_size, exact_limit):
+        self.sample_size = sample_size
+        self.non_null = 0
+        self.distinct = DistinctCounter(exact_limit=exact_limit)
+        self.top = TopK()
+        self.examples = []
+        self.numeric = True
+        self.is_float = False
+        self.has_nulls = False # then an integer column is written as float, like pd.read_csv does
+        self.min = None
+        self.max = None
+        self.total = 0.0
+
+    def add(self, series):
+        values = series.dropna()
+        self.has_nulls = self.has_nulls or len(values) < len(series)
+        if len(values) == 0: # all-null chunks are read as float, they don't tell anything about the type
+            return
+        self.non_null += len(values)
+        self.distinct.add(values)
+        if len(self.examples) < self.sample_size:
+            self.examples.extend(values.head(self.sample_size - len(self.examples)).tolist())
+        if values.dtype in ['int64', 'float64']:
+            self.is_float = self.is_float or values.dtype == 'float64'
+            chunk_min, chunk_max = values.min(), values.max()
+            self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+            self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+            self.total += float(values.sum())
+        else:
+            self.numeric = False
+            self.top.add(values)
+
+    def describe(self, column, total_rows, max_unique_values):
+        """
+        Summary lines in the same format as summarize_csv uses for in-memory profiling. Estimates are marked:
+        the unique count with ~, the most common values with approx. (their counts can be too low)
+        """
+        unique_count = self.distinct.count()
+        lines = [f"Column: '{column}'"]
+        lines.append(f"   Unique values: {unique_count}" if self.distinct.exact else f"   Unique values: ~{unique_count}")
+        null_count = total_rows - self.non_null
+        if null_count > 0:
+            lines.append(f"   Null values: {null_count}")
+        if self.distinct.exact and unique_count <= max_unique_values:
+            try:
+                lines.append(f"   All values: {sorted(self.distinct.values)}")
+            except TypeError: # mixed types
+                lines.append(f"   All values: {sorted(self.distinct.values, key=str)}")
+        elif self.numeric:
+            cast = float if self.is_float else (lambda v: v)
+            lines.append(f"   Min: {cast(self.min)}")
+            lines.append(f"   Max: {cast(self.max)}")
+            lines.append(f"   Mean: {self.total / self.non_null:.2f}")
+            lines.append(f"   Examples: {self.examples}")
+        else:
+            lines.append(f"   Examples: {self.examples}")
+            if unique_count < total_rows * 0.8:
+                if self.top.exact:
+                    lines.append(f"   Most common: {self.top.most_common(5)}")
+                else: # counts of the streaming sketch, see sketches.TopK
+                    lines.append(f"   Most common (approx., counts up to {self.top.error} too low): {self.top.most_common(5)}")
+        lines.append('')
+        return lines
+
+
+def _summarize_csv_streaming(file_path, data_dir, max_unique_values, sample_size, chunksize, output_format='csv'):
+    """
+    Same summary as _summarize_csv, but the file is read in chunks and every column is profiled with
+    bounded memory (exact distinct values up to a threshold, then HyperLogLog; heavy hitters for the most common values,
+    with estimated counts when there are many distinct values).
+    The informative columns are written to the output file in a second pass over the file.
+    """
+    try:
+        profiles = None
+        columns = []
+        duplicates = RowDuplicateCounter()
+        total_rows = 0
+        exact_limit = max(10000, max_unique_values)
+        dtypes = identifier_dtypes(file_path)
+        for chunk in pd.read_csv(file_path, chunksize=chunksize, dtype=dtypes):
+            if profiles is None:
+                columns = list(chunk.columns)
+                profiles = [ColumnProfile(sample_size, exact_limit) for _ in columns]
+            for column, profile in zip(columns, profiles):
+                profile.add(chunk[column])
+            duplicates.add(chunk)
+            total_rows += len(chunk)
+        if profiles is None:
+            raise pd.errors.EmptyDataError('No columns to parse from file')
+
+        info = []
+        info.append(f"CSV File Summary: {file_path}")
+        info.append("=" * 50)
+        info.append(f"Total rows: {total_rows}")
+        info.append(f"Total columns (original file): {len(columns)}")
+        info.append('')
+
+        column_info = []
+        no_values = []
+        one_value = []
+        informative_columns = []
+        value_index = ValueIndex()
+        for column, profile in zip(columns, profiles):
+            unique_count = profile.distinct.count()
+            if unique_count == 0:
+                no_values.append(column)
+            elif unique_count == 1 and profile.distinct.exact:
+                one_value.append((column, next(iter(profile.distinct.values))))
+            else:
+                informative_columns.append(column)
+                column_info.extend(profile.describe(column, total_rows, max_unique_values))
+                if not profile.numeric and profile.distinct.exact and unique_count <= INDEX_MAX_UNIQUE:
+                    value_index.add_column(column, profile.distinct.values)
+
+        extra_info = []
+        if no_values:
+            extra_info.append("Columns without data: " + ', '.join(no_values))
+        if one_value:
+            extra_info.append("Columns where all rows have the same value: " + ', '.join([c+' ('+str(v)+')' for c, v in one_value]))
+
+        duplicate_count = duplicates.count()
+        if duplicate_count > 0:
+            print(f"Duplicate rows: {duplicate_count}")
+            info.append(f"Duplicate rows: {duplicate_count}" if duplicates.exact else f"Duplicate rows: ~{duplicate_count} (estimate)")
+
+        info.append(f"Total columns (informative): {len(informative_columns)}")
+        info.append('')
+
+        # Second pass: write the informative columns chunk by chunk
+        output_file = informative_file_name(file_path, output_format)
+        output_path = os.path.join(data_dir, output_file)
+        chunks = pd.read_csv(file_path, chunksize=chunksize, usecols=informative_columns, dtype=dtypes)
+        if output_format == 'parquet':
+            column_profiles = {column: profile for column, profile in zip(columns, profiles)}
+            write_replacing(output_path, lambda path: _write_parquet_chunks(chunks, informative_columns, column_profiles,
+                                                                            total_rows, path))
+        else:
+            def write_csv(path):
+                header = True
+                for chunk in chunks:
+                    chunk[informative_columns].to_csv(path, index=False, header=header, mode='w' if header else 'a')
+                    header = False
+            write_replacing(output_path, write_csv)
+        value_index.save(os.path.join(data_dir, index_file_name(output_file)))
+        print(f"\nFiltered dataset saved as: {output_file}")
+        print(f"New dataset: {total_rows} rows, {len(informative_columns)} columns")
+
+        return info, column_info, extra_info, output_file
+
+    except FileNotFoundError:
+        print(f"Error: File '{file_path}' not found.")
+    except pd.errors.EmptyDataError:
+        print(f"Error: File '{file_path}' is empty.")
+    except Exception as e:
+        print(f"Error reading file: {str(e)}")
+
+
+def _write_parquet_chunks(chunks, columns, profiles, total_rows, output_path):
+    """
+    Writes csv chunks to one parquet file. The column types are decided up front from the profiles of the first pass,
+    so every chunk gets the same schema (e.g. an int column with nulls in only some chunks).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    categories = {}
+    for column in columns:
+        profile = profiles[column]
+        values = profile.distinct.values
+        if (not profile.numeric and profile.distinct.exact and len(values) <= total_rows * CATEGORY_MAX_FRACTION
+                and all(isinstance(v, str) for v in values)):
+            categories[column] = sorted(values)
+    writer = None
+    try:
+        for chunk in chunks:
+            chunk = chunk[columns]
+            for column in columns:
+                profile = profiles[column]
+                if column in categories:
+                    chunk[column] = pd.Categorical(chunk[column], categories=categories[column])
+                elif profile.numeric and profile.non_null:
+                    chunk[column] = chunk[column].astype('float64' if profile.is_float or profile.has_nulls else 'int64')
+                elif not profile.numeric:
+                    chunk[column] = chunk[column].astype('string')
+            if writer is None:
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                writer = pq.ParquetWriter(output_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
 # Example usage
 if __name__ == "__main__":
     # Replace 'your_file.csv' with the actual path to your CSV file
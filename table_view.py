@@ -0,0 +1,62 @@
+import numpy as np
+import streamlit as st
+from tracing import span
+
+# Paged display of (large) data frames. The data frame stays on the server: sorting and filtering are done here,
+# and only the rows of the current page are sent to the browser, so the payload doesn't grow with the data.
+
+PAGE_SIZE = 100
+MAX_CELLS = 20000 # upper bound on the number of cells sent per page
+
+
+def view_positions(df, sort_column, ascending, filter_column, filter_text):
+    """Row positions of df after filtering and sorting"""
+    positions = np.arange(len(df))
+    if filter_column and filter_text:
+        mask = df[filter_column].astype(str).str.contains(filter_text, case=False, regex=False, na=False)
+        positions = positions[mask.to_numpy()]
+    if sort_column:
+        order = df[sort_column].iloc[positions].reset_index(drop=True).sort_values(ascending=ascending, kind='stable').index
+        positions = positions[order.to_numpy()]
+    return positions
+
+
+def show_table(df, key, page_size=PAGE_SIZE, max_cells=MAX_CELLS):
+    """Shows one page of df, with controls for sorting, filtering and paging. key must be unique on the page."""
+    with span('dataframe_render', key=key, rows=len(df), columns=len(df.columns)):
+        _show_table(df, key, page_size, max_cells)
+
+
+def _show_table(df, key, page_size, max_cells):
+    if len(df.columns) == 0:
+        st.dataframe(df, use_container_width=True)
+        return
+    page_size = max(1, min(page_size, max_cells // len(df.columns)))
+    if len(df) <= page_size: # fits on one page, no controls needed
+        st.dataframe(df, use_container_width=True)
+        return
+    columns = [None] + list(df.columns)
+    with st.expander("Sort and filter", expanded=False):
+        c1, c2, c3, c4 = st.columns([3, 1, 3, 3])
+        sort_column = c1.selectbox("Sort by", columns, key=f"{key}_sort")
+        ascending = c2.toggle("Ascending", value=True, key=f"{key}_asc")
+        filter_column = c3.selectbox("Filter column", columns, key=f"{key}_filter_column")
+        filter_text = c4.text_input("Contains", key=f"{key}_filter_text")
+
+    # the sorted/filtered order is kept in the session, so paging through it doesn't sort again
+    params = (tuple(df.columns), len(df), sort_column, ascending, filter_column, filter_text)
+    cached = st.session_state.get(f"{key}_view")
+    if cached and cached[0] == params:
+        positions = cached[1]
+    else:
+        positions = view_positions(df, sort_column, ascending, filter_column, filter_text)
+        st.session_state[f"{key}_view"] = (params, positions)
+
+    n_pages = max(1, -(-len(positions) // page_size))
+    if st.session_state.get(f"{key}_page", 1) > n_pages: # e.g. after filtering
+        st.session_state[f"{key}_page"] = 1
+    page = st.number_input(f"Page (of {n_pages})", min_value=1, max_value=n_pages, step=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    st.dataframe(df.iloc[positions[start:start + page_size]], use_container_width=True)
+    st.caption(f"Rows {min(start + 1, len(positions))}–{min(start + page_size, len(positions))} of {len(positions)}"
+               + (f" (filtered from {len(df)})" if len(positions) != len(df) else ''))
@@ -0,0 +1,178 @@
+import contextvars
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from interaction_log import InteractionLog
+
+# Span based timing of the stages of the app (summary, LLM call, staging, code run, ...).
+# Spans are correlated by the session and interaction ID, which are kept in context variables,
+# and handed to the configured exporters: json lines (one span per line) and/or Prometheus style histograms.
+#
+#   with tracing.context(session=..., interaction=...):
+#       with tracing.span('llm_call', engine='sql') as s:
+#           ...
+#           s.set(tokens=123)
+
+session_id = contextvars.ContextVar('session_id', default=None)
+interaction_id = contextvars.ContextVar('interaction_id', default=None)
+current_span = contextvars.ContextVar('current_span', default=None)
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120]
+
+_exporters = []
+_span_ids = itertools.count(1)
+
+
+class Span:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.id = f'{os.getpid()}-{next(_span_ids)}'
+        parent = current_span.get()
+        self.parent_id = parent.id if parent else None
+        self.attributes = attributes
+        self.start = time.time()
+        self.seconds = None
+        self.status = 'ok'
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        return {'name': self.name, 'span_id': self.id, 'parent_id': self.parent_id,
+                'session_id': session_id.get(), 'interaction_id': interaction_id.get(),
+                'start': round(self.start, 3), 'seconds': round(self.seconds, 6), 'status': self.status,
+                'attributes': self.attributes}
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time the enclosed block as a span; exceptions are recorded in its status and passed on"""
+    s = Span(name, attributes)
+    token = current_span.set(s)
+    start = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.status = type(e).__name__
+        raise
+    finally:
+        s.seconds = time.perf_counter() - start
+        current_span.reset(token)
+        for exporter in _exporters:
+            try:
+                exporter.export(s)
+            except Exception as e: # tracing must never break the app
+                print(f"Tracing exporter failed: {e}")
+
+
+@contextmanager
+def context(session=None, interaction=None):
+    """Spans in the enclosed block (and in jobs started from it) belong to this session and interaction"""
+    tokens = []
+    if session is not None:
+        tokens.append((session_id, session_id.set(session)))
+    if interaction is not None:
+        tokens.append((interaction_id, interaction_id.set(interaction)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def add_exporter(exporter):
+    _exporters.append(exporter)
+    return exporter
+
+
+class JsonLinesExporter:
+    """
+    Appends every span as a line of json to a file. The spans are written in batches by a background thread
+    (see interaction_log.InteractionLog, the file is rotated the same way), so spans don't wait for file I/O.
+    """
+    def __init__(self, path, **options):
+        self.path = path
+        self.log = InteractionLog(path, **options)
+
+    def export(self, s):
+        self.log.write(s.to_dict())
+
+
+class PrometheusExporter:
+    """Histograms of the span durations per span name, in the Prometheus text format (optionally served over http)"""
+    def __init__(self, prefix='csv_app_span'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.histograms = {} # name -> [bucket counts, sum, count, errors]
+        self.server = None
+
+    def export(self, s):
+        with self.lock:
+            histogram = self.histograms.setdefault(s.name, [[0] * len(BUCKETS), 0.0, 0, 0])
+            for i, bound in enumerate(BUCKETS):
+                if s.seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += s.seconds
+            histogram[2] += 1
+            histogram[3] += s.status != 'ok'
+
+    def render(self):
+        lines = [f'# HELP {self.prefix}_seconds Duration of the traced stages of the app',
+                 f'# TYPE {self.prefix}_seconds histogram']
+        errors = [f'# HELP {self.prefix}_errors_total Spans that ended with an exception',
+                  f'# TYPE {self.prefix}_errors_total counter']
+        with self.lock:
+            for name, (buckets, total, count, failed) in sorted(self.histograms.items()):
+                for bound, n in zip(BUCKETS, buckets):
+                    lines.append(f'{self.prefix}_seconds_bucket{{span="{name}",le="{bound}"}} {n}')
+                lines.append(f'{self.prefix}_seconds_bucket{{span="{name}",le="+Inf"}} {count}')
+                lines.append(f'{self.prefix}_seconds_sum{{span="{name}"}} {total:.6f}')
+                lines.append(f'{self.prefix}_seconds_count{{span="{name}"}} {count}')
+                errors.append(f'{self.prefix}_errors_total{{span="{name}"}} {failed}')
+        return '\n'.join(lines + errors) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serve the metrics on http://host:port/metrics, in a background thread"""
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                found = self.path in ('/', '/metrics')
+                body = exporter.render().encode() if found else b'not found\n'
+                self.send_response(200 if found else 404)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args): # no access log on stderr
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+
+class InteractionCollector:
+    """Keeps the spans of recent interactions, so they can be summarized in the interaction log"""
+    def __init__(self, max_interactions=1000):
+        self.max_interactions = max_interactions
+        self.lock = threading.Lock()
+        self.spans = OrderedDict() # interaction id -> list of span dicts
+
+    def export(self, s):
+        interaction = interaction_id.get()
+        if interaction is None:
+            return
+        with self.lock:
+            self.spans.setdefault(interaction, []).append(s.to_dict())
+            while len(self.spans) > self.max_interactions: # e.g. interactions that were stopped halfway
+                self.spans.popitem(last=False)
+
+    def pop(self, interaction):
+        """The spans of an interaction that have ended so far, which are then forgotten"""
+        with self.lock:
+            return self.spans.pop(interaction, [])
@@ -0,0 +1,114 @@
+import difflib
+import json
+import os
+import re
+from prompt_builder import STOP_WORDS
+
+# Inverted index from the distinct values of text columns to the columns that hold them, so values mentioned in a
+# question ("Show me data for Aarhus") can be linked to their column before the LLM is called, instead of the LLM
+# guessing the column (and a failed guess costing a retry). Only columns with at most INDEX_MAX_UNIQUE distinct values
+# are indexed; columns with more (free text, identifiers) would make the index large and the matches noisy.
+# The index is written as json next to the working file.
+
+INDEX_MAX_UNIQUE = 10000
+MAX_PHRASE_WORDS = 4 # values of up to this many words are found in the question
+FUZZY_CUTOFF = 0.85 # similarity (difflib ratio) for a fuzzy match, e.g. misspelled names
+FUZZY_MIN_CHARS = 4
+MAX_MATCHES = 10
+
+
+def normalize(value):
+    """Lower case, with whitespace collapsed"""
+    return ' '.join(str(value).lower().split())
+
+
+def index_file_name(output_file):
+    """Name of the value index of a working file, which is written to the same directory"""
+    return os.path.splitext(output_file)[0] + '_values.json'
+
+
+def phrases(question, max_words=MAX_PHRASE_WORDS):
+    """All sequences of up to max_words consecutive words of the question, longest first"""
+    tokens = re.findall(r"[\w][\w.'&/-]*", question.lower())
+    tokens = [t.rstrip(".'") for t in tokens]
+    found = []
+    for n in range(min(max_words, len(tokens)), 0, -1):
+        for start in range(len(tokens) - n + 1):
+            found.append((start, start + n, ' '.join(tokens[start:start + n])))
+    return found
+
+
+class ValueIndex:
+    def __init__(self, values=None):
+        self.values = values or {} # normalized value -> [original value, [columns]]
+        self._by_first_char = None # fuzzy candidates, grouped so a term is only compared to similar values
+
+    def add_column(self, column, values):
+        for value in values:
+            if not isinstance(value, str) or not value.strip():
+                continue
+            entry = self.values.setdefault(normalize(value), [value, []])
+            if column not in entry[1]:
+                entry[1].append(column)
+        self._by_first_char = None
+
+    def save(self, path):
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.values, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        """The index stored at path; an empty index if there is none"""
+        try:
+            with open(path) as f:
+                return cls(json.load(f))
+        except (OSError, ValueError):
+            return cls()
+
+    def _fuzzy_candidates(self, term):
+        if self._by_first_char is None:
+            self._by_first_char = {}
+            for key in self.values:
+                self._by_first_char.setdefault(key[0], []).append(key)
+        return self._by_first_char.get(term[0], [])
+
+    def lookup(self, question, fuzzy=True, max_matches=MAX_MATCHES):
+        """
+        Values of the index that are mentioned in the question, as (term in the question, value, columns) tuples.
+        Exact matches of phrases come first (longest phrases first, words are only matched once);
+        then remaining single words that are close to a value.
+        """
+        if not self.values:
+            return []
+        matches = []
+        used = set() # positions of words that are part of a match
+        for start, end, phrase in phrases(question):
+            if used.intersection(range(start, end)) or phrase not in self.values or phrase in STOP_WORDS:
+                continue
+            value, columns = self.values[phrase]
+            matches.append((phrase, value, columns))
+            used.update(range(start, end))
+        if fuzzy:
+            for start, end, phrase in phrases(question, max_words=1):
+                if start in used or len(phrase) < FUZZY_MIN_CHARS or phrase.isdigit() or phrase in STOP_WORDS:
+                    continue
+                close = difflib.get_close_matches(phrase, self._fuzzy_candidates(phrase), n=1, cutoff=FUZZY_CUTOFF)
+                if close:
+                    value, columns = self.values[close[0]]
+                    matches.append((phrase, value, columns))
+                    used.add(start)
+        return matches[:max_matches]
+
+
+def describe_matches(matches):
+    """Lines for the prompt about the values mentioned in the question"""
+    lines = []
+    for term, value, columns in matches:
+        where = ' and '.join(f"'{c}'" for c in columns)
+        kind = 'column' if len(columns) == 1 else 'columns'
+        if normalize(term) == normalize(value):
+            lines.append(f"'{value}' is a value of {kind} {where}")
+        else:
+            lines.append(f"'{term}' probably refers to '{value}', a value of {kind} {where}")
+    return lines
@@ -0,0 +1,245 @@
+import atexit
+import io
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from contextlib import redirect_stdout, redirect_stderr
+from shared_data import load_shared_frame, intercept_readers, restore_readers
+from write_manifest import record_writes, restore_writes
+from resource_limits import (apply_limits, restore_limits, install_signal_handlers, start_accounting,
+                             finish_accounting, CPULimitExceeded)
+
+# Pool of warm Python worker processes for executing generated code.
+# The workers import pandas/numpy/matplotlib once at startup and then execute code blocks sent over a pipe,
+# so a code block only costs the time of the code itself instead of interpreter startup + imports.
+
+PRELOAD_MODULES = ['pandas', 'numpy', 'matplotlib', 'pyarrow']
+POLL_INTERVAL = 0.2 # seconds between checks for cancellation while code is running
+
+
+def _preload():
+    import pandas
+    if int(pandas.__version__.split('.')[0]) < 3:
+        pandas.options.mode.copy_on_write = True # default from pandas 3, needed for sharing the preloaded data frame
+    import numpy
+    import matplotlib
+    matplotlib.use('Agg') # plots are only written to files
+    import matplotlib.pyplot
+
+
+def _run_job(job, namespace=None):
+    """
+    Executes one code block in the job's directory, in a fresh namespace or in the given (persistent) one.
+    Returns the result dict sent back to the pool.
+    """
+    import pandas as pd
+    import matplotlib.pyplot as plt
+    snapshot = start_accounting()
+    stdout, stderr = io.StringIO(), io.StringIO()
+    success = True
+    if namespace is None:
+        namespace = {'__name__': '__main__'}
+    original_readers = None
+    shared = job.get('shared')
+    if shared: # the working dataset, preloaded from its Arrow copy
+        try:
+            if 'df' not in namespace: # a persistent namespace keeps df, possibly already filtered
+                namespace['df'] = load_shared_frame(shared['arrow_path'])
+            original_readers = intercept_readers(pd, shared['file_name'], shared['arrow_path'])
+        except Exception as e:
+            print(f"Could not load shared dataset: {e}", file=sys.stderr)
+    os.chdir(job['cwd'])
+    limits = job.get('limits') or {}
+    saved_limits = apply_limits(limits) # after loading the shared data, so its memory map doesn't count
+    written = set()
+    try: # whatever happens, the limits are restored: the worker (or kernel) runs further jobs
+        original_writers = record_writes(written)
+        try:
+            with redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    exec(compile(job['code'], '<string>', 'exec'), namespace)
+                except SystemExit as e:
+                    success = e.code in (None, 0)
+                except MemoryError:
+                    traceback.print_exc()
+                    print(f"Memory limit of {limits.get('max_memory_mb')} MB exceeded", file=sys.stderr)
+                    success = False
+                except CPULimitExceeded:
+                    print(f"CPU time limit of {limits.get('max_cpu_seconds')} seconds exceeded", file=sys.stderr)
+                    success = False
+                except BaseException:
+                    traceback.print_exc()
+                    success = False
+        finally:
+            restore_writes(original_writers)
+    finally:
+        restore_limits(saved_limits)
+        if original_readers is not None:
+            restore_readers(pd, original_readers)
+        plt.close('all')
+        os.chdir(job['home'])
+    return {'success': success, 'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(),
+            'resources': finish_accounting(snapshot), 'written': sorted(written)}
+
+
+def describe_namespace(namespace, max_variables=30):
+    """Short description of the user variables in a namespace, one line per variable"""
+    import pandas as pd
+    lines = []
+    for name, value in namespace.items():
+        if name.startswith('_') or callable(value) or type(value).__name__ == 'module':
+            continue
+        if isinstance(value, pd.DataFrame):
+            columns = ', '.join(map(str, value.columns[:20])) + (', ...' if len(value.columns) > 20 else '')
+            lines.append(f"{name}: DataFrame with {len(value)} rows, columns: {columns}")
+        elif isinstance(value, pd.Series):
+            lines.append(f"{name}: Series '{value.name}' with {len(value)} values, dtype {value.dtype}")
+        elif isinstance(value, (list, tuple, dict, set)):
+            lines.append(f"{name}: {type(value).__name__} with {len(value)} items")
+        else:
+            lines.append(f"{name}: {type(value).__name__} = {repr(value)[:80]}")
+        if len(lines) >= max_variables:
+            lines.append('...')
+            break
+    return '\n'.join(lines)
+
+
+def _worker_main(conn):
+    """Main loop of a worker process"""
+    _preload()
+    install_signal_handlers()
+    conn.send('ready')
+    persistent = {'__name__': '__main__'} # namespace for persistent jobs, kept between them (see SessionKernel)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if job is None: # shutdown
+            break
+        if job.get('describe'):
+            conn.send(describe_namespace(persistent))
+        else:
+            conn.send(_run_job(job, persistent if job.get('persistent') else None))
+
+
+class Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+        self.ready = False
+
+    def wait_ready(self, timeout):
+        if not self.ready and self.conn.poll(timeout):
+            self.ready = self.conn.recv() == 'ready'
+        return self.ready
+
+    def kill(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(1)
+
+
+def wait_for_result(worker, timeout, cancel_event=None):
+    """Waits until the worker has sent its result, the timeout has passed or cancel_event is set. Returns (finished, cancelled)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        finished = worker.conn.poll(max(0, min(POLL_INTERVAL, deadline - time.monotonic())))
+        cancelled = cancel_event is not None and cancel_event.is_set()
+        if finished or cancelled or time.monotonic() >= deadline:
+            return finished, cancelled
+
+
+class WorkerPool:
+    def __init__(self, size=2, max_jobs_per_worker=50, startup_timeout=60):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker # workers are recycled after this many jobs
+        self.startup_timeout = startup_timeout
+        self.context = multiprocessing.get_context('forkserver') # don't fork the (multi-threaded) app process
+        self.context.set_forkserver_preload(PRELOAD_MODULES) # so new workers are forked with the imports already done
+        self.home = os.getcwd()
+        self.idle = queue.Queue()
+        self.closed = False
+        for _ in range(size):
+            self.idle.put(Worker(self.context))
+
+    def _acquire(self):
+        worker = self.idle.get()
+        if not worker.process.is_alive() or not worker.wait_ready(self.startup_timeout):
+            worker.kill()
+            worker = Worker(self.context)
+            worker.wait_ready(self.startup_timeout)
+        return worker
+
+    def _release(self, worker, recycle=False):
+        if self.closed:
+            worker.kill()
+            return
+        if recycle or worker.jobs >= self.max_jobs_per_worker:
+            worker.kill()
+            worker = Worker(self.context) # replacement starts warming up right away
+        self.idle.put(worker)
+
+    def run(self, code, cwd, timeout, shared=None, cancel_event=None, limits=None):
+        """
+        Execute code in cwd on a warm worker. Returns a dict with success, stdout, stderr, resources (see
+        resource_limits.finish_accounting) and written (paths of the files written by the code); raises TimeoutError on timeout.
+        shared: optional dict with 'file_name' and 'arrow_path' of the working dataset, which is then preloaded as df
+        cancel_event: optional threading.Event, the code is stopped when it is set
+        limits: optional dict of limits for the code, see resource_limits.apply_limits
+        """
+        worker = self._acquire()
+        try:
+            worker.conn.send({'code': code, 'cwd': cwd, 'home': self.home, 'shared': shared, 'limits': limits})
+            finished, cancelled = wait_for_result(worker, timeout, cancel_event)
+            result = worker.conn.recv() if finished else None
+        except (EOFError, OSError): # the worker died, e.g. it was killed by the OS
+            self._release(worker, recycle=True)
+            return {'success': False, 'stdout': '', 'stderr': 'Worker process died during execution'}
+        if not finished:
+            self._release(worker, recycle=True) # the only way to stop the code is to kill the worker
+            if cancelled:
+                return {'success': False, 'stdout': '', 'stderr': 'Code execution was cancelled'}
+            raise TimeoutError(f'Code execution timed out after {timeout} seconds')
+        worker.jobs += 1
+        # a failed job may have left modules in a bad state, so don't reuse the worker
+        self._release(worker, recycle=not result['success'])
+        return result
+
+    def shutdown(self):
+        self.closed = True
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.kill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(size=None):
+    """The process wide worker pool, started on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(size=size or min(4, os.cpu_count() or 1))
+            atexit.register(_pool.shutdown)
+        return _pool
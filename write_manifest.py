@@ -0,0 +1,96 @@
+import builtins
+import importlib
+import os
+import shutil
+import stat
+
+# Records which files generated code writes, so its outputs are known exactly, whatever way the file name was
+# written in the code (quotes, f-strings, variables). File opens for writing are recorded, as well as the writers
+# of pandas, pyarrow and matplotlib that don't go through open() (e.g. to_parquet via pyarrow).
+# Staged input files are links to shared files: before such a file is written, the link is replaced by a private copy.
+
+WRITE_MODES = set('wax+')
+DATAFRAME_WRITERS = ['to_csv', 'to_parquet', 'to_feather', 'to_excel', 'to_json', 'to_pickle']
+ARROW_WRITERS = [('pyarrow.parquet', 'write_table'), ('pyarrow.feather', 'write_feather'), ('pyarrow.csv', 'write_csv')]
+PATH_ARGUMENTS = ['path_or_buf', 'path', 'excel_writer', 'fname', 'file', 'where', 'dest', 'output_file']
+
+
+def detach(path, keep_content=False):
+    """
+    If path is a link (symlink, or a hard link shared with another file), replace it by a file of its own,
+    so writing to it can't change the file it links to. keep_content is needed for appends and updates,
+    otherwise the file is about to be overwritten and the link is just removed.
+    """
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return
+    if not (stat.S_ISLNK(info.st_mode) or (stat.S_ISREG(info.st_mode) and info.st_nlink > 1)):
+        return
+    if keep_content:
+        shutil.copyfile(path, path + '.detached') # a new file, so not read-only like the staged link
+        os.replace(path + '.detached', path)
+    else:
+        os.unlink(path)
+
+
+def _record(manifest, target, keep_content=False):
+    if isinstance(target, (str, os.PathLike)):
+        manifest.add(os.path.abspath(os.fspath(target)))
+        detach(target, keep_content)
+
+
+def _first_argument(args, kwargs):
+    if args:
+        return args[0]
+    return next((kwargs[name] for name in PATH_ARGUMENTS if name in kwargs), None)
+
+
+def _recording(function, manifest):
+    def writer(self, *args, **kwargs): # for pyarrow functions, self is the table
+        _record(manifest, _first_argument(args, kwargs), keep_content='a' in str(kwargs.get('mode', '')))
+        return function(self, *args, **kwargs)
+    return writer
+
+
+def record_writes(manifest):
+    """
+    Adds the paths of files written from now on to the set manifest (as absolute paths).
+    Returns the original functions, so they can be restored with restore_writes.
+    """
+    import pandas as pd
+    from matplotlib.figure import Figure
+    originals = [(builtins, 'open', builtins.open), (Figure, 'savefig', Figure.savefig)]
+    originals += [(cls, name, getattr(cls, name)) for cls in (pd.DataFrame, pd.Series)
+                  for name in DATAFRAME_WRITERS if hasattr(cls, name)]
+    for module_name, name in ARROW_WRITERS:
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError:
+            continue
+        originals.append((module, name, getattr(module, name)))
+
+    def open_file(file, mode='r', *args, **kwargs):
+        if WRITE_MODES & set(mode):
+            _record(manifest, file, keep_content='w' not in mode)
+        return originals[0][2](file, mode, *args, **kwargs)
+
+    builtins.open = open_file
+    for cls, name, function in originals[1:]:
+        setattr(cls, name, _recording(function, manifest))
+    return originals
+
+
+def restore_writes(originals):
+    for owner, name, function in originals:
+        setattr(owner, name, function)
+
+
+def manifest_outputs(manifest, directory):
+    """The recorded files that exist in directory, as paths relative to it"""
+    directory = os.path.abspath(directory)
+    outputs = []
+    for path in sorted(manifest):
+        if os.path.commonpath([path, directory]) == directory and os.path.isfile(path):
+            outputs.append(os.path.relpath(path, directory))
+    return outputs